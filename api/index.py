@@ -1,383 +1,2081 @@
-from garminconnect import Garmin
-from datetime import datetime
-from http.server import BaseHTTPRequestHandler
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict, deque
 import os
+import random
+import re
+import sys
+import gzip
+import base64
 import json
+import hashlib
+import sqlite3
+import threading
+import time
 import traceback
+import zlib
+
+# Encodeurs optionnels : utilisés seulement s'ils sont installés
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Stockage des tokens OAuth (ex: /tmp sur Vercel, dossier local en self-hosting),
+# un sous-dossier par compte
+TOKEN_DIR = os.environ.get('GARMIN_TOKEN_DIR', '/tmp/garmin_tokens')
+
+# Comptes : clé d'API -> {"email", "password"} (GARMIN_ACCOUNTS en JSON ou GARMIN_ACCOUNTS_FILE).
+# Sans clé d'API, la requête utilise GARMIN_EMAIL/GARMIN_PASSWORD s'ils sont définis.
+CLIENT_POOL_SIZE = int(os.environ.get('GARMIN_CLIENT_POOL_SIZE', '8'))
+ACCOUNT_POOL_SIZE = int(os.environ.get('GARMIN_ACCOUNT_POOL_SIZE', '256'))
+
+
+def load_accounts():
+    raw = os.environ.get('GARMIN_ACCOUNTS')
+    path = os.environ.get('GARMIN_ACCOUNTS_FILE')
+    if not raw and path and os.path.exists(path):
+        with open(path) as f:
+            raw = f.read()
+    accounts = json.loads(raw) if raw else {}
+    return {key: account for key, account in accounts.items() if account.get('email') and account.get('password')}
+
+
+ACCOUNTS = load_accounts()
+ACCOUNT_NAMES = {account['email']: account['name'] for account in ACCOUNTS.values() if account.get('name')}
+
+
+def resolve_account(api_key):
+    """(email, password) du compte de la requête, None si la clé est inconnue ou absente"""
+    if api_key:
+        account = ACCOUNTS.get(api_key)
+        return (account['email'], account['password']) if account else None
+    email = os.environ.get('GARMIN_EMAIL')
+    password = os.environ.get('GARMIN_PASSWORD')
+    return (email, password) if email and password else None
+
+
+def account_label(email):
+    """Nom du compte dans les métriques (publiques) : `name` de GARMIN_ACCOUNTS,
+    sinon un hash de l'email, jamais l'email lui-même"""
+    if not email:
+        return "default"
+    return ACCOUNT_NAMES.get(email) or "account-" + hashlib.sha1(email.lower().encode()).hexdigest()[:12]
+
+
+def token_dir(email):
+    return os.path.join(TOKEN_DIR, hashlib.sha1(email.lower().encode()).hexdigest()[:16])
+
+
+class LRU:
+    """Dictionnaire borné : l'entrée la moins récemment utilisée est évincée"""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                value = self.items[key] = factory()
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+            return value
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.items.items())
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+# Sessions Garmin authentifiées réutilisées entre les requêtes, par compte
+client_pool = LRU(CLIENT_POOL_SIZE)
+
+# Types de session comptés par compte dans METRICS : reused (instance chaude),
+# restored (tokens sur disque), refreshed (OAuth2 expiré puis rafraîchi),
+# login (connexion complète par mot de passe)
+SESSION_KINDS = ("reused", "restored", "refreshed", "login")
+
+
+def _count_session(kind, email):
+    METRICS.count_session(kind, email)
+
+
+def _save_tokens(client):
+    try:
+        client.garth.dump(token_dir(client.username))
+    except Exception:
+        # Un stockage en lecture seule ne doit pas empêcher la requête
+        pass
+
+
+def Garmin(email, password):
+    """Importe garminconnect au premier login seulement (health et metrics n'en ont pas besoin)"""
+    from garminconnect import Garmin
+    return Garmin(email, password)
+
+
+def _login_call(email, fn):
+    """Appel d'authentification passé par le token bucket du compte (backoff sur 429 compris)"""
+    return scheduler_for(email).call(fn, INTERACTIVE, time.monotonic() + REQUEST_DEADLINE)
+
+
+def _password_login(email, password):
+    client = Garmin(email, password)
+    _login_call(email, client.login)
+    _save_tokens(client)
+    return client
+
+
+def _refresh_if_expired(client, email, password):
+    """Rafraîchit l'OAuth2 seulement s'il a expiré, sinon reconnexion complète.
+
+    Retourne (client, type de session : None si rien n'a changé, "refreshed" ou "login").
+    """
+    oauth2 = client.garth.oauth2_token
+    if oauth2 is not None and not oauth2.expired:
+        return client, None
+    try:
+        _login_call(email, client.garth.refresh_oauth2)
+    except Exception:
+        return _password_login(email, password), "login"
+    _save_tokens(client)
+    return client, "refreshed"
+
+
+def get_client(email, password, timings=None):
+    """Comme _get_client, en mesurant la durée de connexion"""
+    started = time.perf_counter()
+    try:
+        client = _get_client(email, password)
+    except Exception as e:
+        record_timing(timings, 'login', time.perf_counter() - started, type(e).__name__, email)
+        raise
+    record_timing(timings, 'login', time.perf_counter() - started, 'ok', email)
+    return client
+
+
+def _get_client(email, password):
+    """Retourne un client Garmin authentifié en évitant le login SSO complet.
+
+    Ordre : session en mémoire (client_pool), puis tokens sauvegardés dans
+    token_dir(email), puis login par mot de passe en dernier recours. Les
+    logins simultanés d'un même compte n'en font qu'un.
+    """
+    client = client_pool.get(email)
+    if client is not None:
+        client, kind = _refresh_if_expired(client, email, password)
+        kind = kind or "reused"
+    else:
+        client, kind = single_flight.do(json.dumps(["login", email]), lambda: _restore_or_login(email, password))
+    # Un seul type compté par requête (les requêtes qui partagent un login comptent le même)
+    _count_session(kind, email)
+    # Timeout réseau de chaque appel Garmin
+    client.garth.timeout = CALL_TIMEOUT
+    client_pool.put(email, client)
+    return client
+
+
+def _restore_or_login(email, password):
+    """Retourne (client, "restored" | "refreshed" | "login")"""
+    try:
+        restored = Garmin(email, password)
+        restored.garth.load(token_dir(email))
+        client, kind = _refresh_if_expired(restored, email, password)
+        if client is restored:
+            # Charge profil et réglages à partir des tokens (pas de SSO)
+            _login_call(email, lambda: client.login(client.garth.dumps()))
+        return client, kind or "restored"
+    except Exception:
+        return _password_login(email, password), "login"
+
+
+# Appels Garmin en parallèle (pool partagé entre les requêtes d'une instance)
+FETCH_WORKERS = int(os.environ.get('GARMIN_FETCH_WORKERS', '8'))
+CALL_TIMEOUT = float(os.environ.get('GARMIN_CALL_TIMEOUT', '8'))
+REQUEST_DEADLINE = float(os.environ.get('GARMIN_REQUEST_DEADLINE', '9'))
+_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+# Pool séparé pour les plages et la sync : ils ne bloquent pas les requêtes interactives
+_background_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+
+# Mesures : durée et résultat (ok, empty, cached, timeout, type d'erreur) de chaque appel
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    """Histogrammes de latence, compteurs d'appels et de sessions cumulés par compte.
+
+    Les valeurs ne font que croître (Prometheus calcule lui-même les fenêtres
+    avec rate()) ; elles sont gardées pour au plus ACCOUNT_POOL_SIZE comptes,
+    les moins récemment actifs étant oubliés.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accounts = LRU(ACCOUNT_POOL_SIZE)
+
+    def _stats(self, account):
+        return self.accounts.get_or_create(account_label(account), lambda: {"calls": {}, "latency": {}, "sessions": dict.fromkeys(SESSION_KINDS, 0)})
+
+    def count_session(self, kind, account):
+        stats = self._stats(account)
+        with self.lock:
+            stats["sessions"][kind] += 1
+
+    def sessions(self):
+        """Compteurs de sessions par compte"""
+        with self.lock:
+            return {account: dict(stats["sessions"]) for account, stats in self.accounts.snapshot()}
+
+    def record(self, method_name, seconds, outcome, account=None):
+        stats = self._stats(account)
+        with self.lock:
+            stats["calls"][(method_name, outcome)] = stats["calls"].get((method_name, outcome), 0) + 1
+            # [compte par borne de LATENCY_BUCKETS..., total, somme]
+            latency = stats["latency"].setdefault(method_name, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+            for i, bucket in enumerate(LATENCY_BUCKETS):
+                if seconds <= bucket:
+                    latency[i] += 1
+            latency[-2] += 1
+            latency[-1] += seconds
+
+    def prometheus(self):
+        """Export au format texte Prometheus"""
+        with self.lock:
+            accounts = [
+                (account, dict(stats["calls"]), {m: list(v) for m, v in stats["latency"].items()})
+                for account, stats in self.accounts.snapshot()
+            ]
+        sessions = self.sessions()
+        lines = [
+            "# HELP garmin_upstream_duration_seconds Durée des appels Garmin",
+            "# TYPE garmin_upstream_duration_seconds histogram",
+        ]
+        for account, _, latency in sorted(accounts, key=lambda a: a[0]):
+            for method_name, values in sorted(latency.items()):
+                labels = f'account="{account}",method="{method_name}"'
+                for bucket, count in zip(LATENCY_BUCKETS, values):
+                    lines.append(f'garmin_upstream_duration_seconds_bucket{{{labels},le="{bucket}"}} {count}')
+                lines.append(f'garmin_upstream_duration_seconds_bucket{{{labels},le="+Inf"}} {values[-2]}')
+                lines.append(f'garmin_upstream_duration_seconds_sum{{{labels}}} {values[-1]:.6f}')
+                lines.append(f'garmin_upstream_duration_seconds_count{{{labels}}} {values[-2]}')
+        lines.append("# HELP garmin_upstream_calls_total Appels Garmin par compte, méthode et résultat")
+        lines.append("# TYPE garmin_upstream_calls_total counter")
+        for account, calls, _ in sorted(accounts, key=lambda a: a[0]):
+            for (method_name, outcome), count in sorted(calls.items()):
+                lines.append(f'garmin_upstream_calls_total{{account="{account}",method="{method_name}",outcome="{outcome}"}} {count}')
+        lines.append("# HELP garmin_sessions_total Sessions Garmin par type (reused, restored, refreshed, login)")
+        lines.append("# TYPE garmin_sessions_total counter")
+        for account, counts in sorted(sessions.items()):
+            for kind, count in counts.items():
+                lines.append(f'garmin_sessions_total{{account="{account}",kind="{kind}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def record_timing(timings, name, seconds, outcome, account=None):
+    """Enregistre un appel dans les métriques globales et, si fourni, dans les mesures de la requête"""
+    METRICS.record(name, seconds, outcome, account)
+    if timings is not None:
+        timings.append((name, seconds, outcome))
+
+
+def server_timing(timings):
+    """En-tête Server-Timing : login;dur=120.5;desc="ok", get_stats;dur=80.1;desc="cached", ..."""
+    return ', '.join(f'{name};dur={seconds * 1000:.1f};desc="{outcome}"' for name, seconds, outcome in timings)
+
+
+# Ordonnancement des appels Garmin : déduplication (single-flight) et token bucket
+UPSTREAM_RATE = float(os.environ.get('GARMIN_UPSTREAM_RATE', '5'))
+UPSTREAM_BURST = float(os.environ.get('GARMIN_UPSTREAM_BURST', '15'))
+UPSTREAM_RETRIES = int(os.environ.get('GARMIN_UPSTREAM_RETRIES', '3'))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class DeadlineExceeded(Exception):
+    """L'appel ne peut plus aboutir avant le délai de la requête"""
+
+
+class SingleFlight:
+    """Les appels identiques simultanés partagent un seul appel réel"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, deadline=None):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "value": None, "error": None}
+        if not leader:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            if not call["done"].wait(timeout):
+                raise DeadlineExceeded(key)
+            if call["error"] is not None:
+                raise call["error"]
+            return call["value"]
+        try:
+            call["value"] = fn()
+            return call["value"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+def http_status(error):
+    """Code HTTP d'une erreur garminconnect/garth/requests (None si inconnu)"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if 'TooManyRequests' in type(error).__name__:
+            return 429
+        for source in (error, getattr(error, 'error', None)):
+            status = getattr(getattr(source, 'response', None), 'status_code', None)
+            if isinstance(status, int):
+                return status
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class UpstreamScheduler:
+    """Token bucket (`rate` appels/s, rafale `burst`) partagé par les appels Garmin d'un compte.
+
+    Un jeton n'est donné à un appel BACKGROUND (plages, sync) que si aucun appel
+    INTERACTIVE n'attend. Après un 429 ou un 5xx, l'appel est relancé avec un
+    backoff exponentiel et du jitter ; un 429 suspend aussi tous les appels du compte.
+    Avec un `deadline` (time.monotonic()), un appel qui ne peut plus obtenir de
+    jeton ou être relancé à temps lève DeadlineExceeded au lieu d'attendre.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.waiting = [0, 0]
+        self.cond = threading.Condition()
+
+    def acquire(self, priority, deadline=None):
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    blocked = priority == BACKGROUND and self.waiting[INTERACTIVE] > 0
+                    if now >= self.paused_until and self.tokens >= 1 and not blocked:
+                        self.tokens -= 1
+                        return
+                    delay = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0.01)
+                    if deadline is not None:
+                        # Le jeton (ou la fin de la pause) arriverait trop tard
+                        if now + max(self.paused_until - now, (1 - self.tokens) / self.rate) >= deadline:
+                            raise DeadlineExceeded("jeton Garmin")
+                        delay = min(delay, deadline - now)
+                    self.cond.wait(delay)
+            finally:
+                self.waiting[priority] -= 1
+                self.cond.notify_all()
+
+    def call(self, fn, priority=INTERACTIVE, deadline=None):
+        attempt = 0
+        while True:
+            self.acquire(priority, deadline)
+            try:
+                return fn()
+            except Exception as e:
+                status = http_status(e)
+                if attempt >= UPSTREAM_RETRIES or status is None or (status != 429 and status < 500):
+                    raise
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+                if status == 429:
+                    with self.cond:
+                        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    # Pas de nouvel essai possible avant le délai : l'erreur d'origine remonte
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+
+single_flight = SingleFlight()
+# Un token bucket par compte (les comptes inactifs sont oubliés, leur seau repart plein)
+schedulers = LRU(ACCOUNT_POOL_SIZE)
+
+
+def scheduler_for(account):
+    return schedulers.get_or_create(account, lambda: UpstreamScheduler(UPSTREAM_RATE, UPSTREAM_BURST))
+
+
+# Cache des réponses Garmin brutes : LRU en mémoire devant un SQLite sur disque
+CACHE_DB = os.environ.get('GARMIN_CACHE_DB', '/tmp/garmin_cache.sqlite')
+CACHE_SIZE = int(os.environ.get('GARMIN_CACHE_SIZE', '512'))
+CACHE_TTL_TODAY = int(os.environ.get('GARMIN_CACHE_TTL_TODAY', '300'))
+CACHE_TTL_YESTERDAY = int(os.environ.get('GARMIN_CACHE_TTL_YESTERDAY', '3600'))
+DATE_ARG = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class UpstreamCache:
+    """Cache (compte, méthode, arguments) -> réponse Garmin, avec expiration.
+
+    Les entrées sans date d'expiration (jours passés) ne sont jamais rafraîchies.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+
+    def _connect(self):
+        if self.db is None:
+            try:
+                self.db = sqlite3.connect(self.path, check_same_thread=False)
+                self.db.execute("CREATE TABLE IF NOT EXISTS upstream (key TEXT PRIMARY KEY, expires REAL, payload TEXT)")
+            except sqlite3.Error:
+                # Disque indisponible : on garde seulement le cache mémoire
+                self.db = False
+        return self.db
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Retourne (trouvé, valeur)"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                db = self._connect()
+                row = db.execute("SELECT expires, payload FROM upstream WHERE key = ?", (key,)).fetchone() if db else None
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self._remember(key, entry)
+            else:
+                self.memory.move_to_end(key)
+        if entry is None or (entry[0] is not None and entry[0] <= now):
+            return False, None
+        return True, entry[1]
+
+    def set(self, key, value, ttl):
+        entry = (None if ttl is None else time.time() + ttl, value)
+        with self.lock:
+            self._remember(key, entry)
+            db = self._connect()
+            if db:
+                try:
+                    db.execute("INSERT OR REPLACE INTO upstream VALUES (?, ?, ?)", (key, entry[0], json.dumps(value)))
+                    db.commit()
+                except sqlite3.Error:
+                    pass
+
+
+upstream_cache = UpstreamCache(CACHE_DB, CACHE_SIZE)
+
+
+def cache_ttl(args, value):
+    """TTL selon la date la plus récente des arguments (None = permanent)
+
+    L'âge est compté sur l'horloge du serveur (UTC sur Vercel) : un jour de marge
+    couvre le décalage horaire de l'utilisateur. Une réponse vide n'est jamais
+    permanente, la montre peut se synchroniser plus tard.
+    """
+    dates = [a for a in args if isinstance(a, str) and DATE_ARG.match(a)]
+    if not dates:
+        return CACHE_TTL_TODAY
+    age = (datetime.now().date() - datetime.strptime(max(dates), "%Y-%m-%d").date()).days
+    if age <= 1:
+        return CACHE_TTL_TODAY
+    if age == 2 or not value:
+        return CACHE_TTL_YESTERDAY
+    return None
+
+
+# Détails d'une activité terminée : jamais modifiés, gardés sans expiration
+IMMUTABLE_METHODS = ('get_activity_splits', 'get_activity_split_summaries', 'get_activity_hr_in_timezones')
+
+
+def cached_call(client, method_name, *args, priority=INTERACTIVE, deadline=None):
+    """Appelle client.method_name(*args) en passant par le cache, le single-flight
+    et le scheduler du compte.
+
+    Retourne (trouvé dans le cache, valeur).
+    """
+    key = json.dumps([client.username, method_name, args])
+    found, value = upstream_cache.get(key)
+    if found:
+        return True, value
+
+    def fetch():
+        value = scheduler_for(client.username).call(lambda: getattr(client, method_name)(*args), priority, deadline)
+        immutable = method_name in IMMUTABLE_METHODS and value
+        upstream_cache.set(key, value, None if immutable else cache_ttl(args, value))
+        return value
+
+    return False, single_flight.do(key, fetch, deadline)
+
+
+def summary_etag(data):
+    """ETag faible du résumé (valable pour tous les encodages), sans l'horodatage"""
+    body = json.dumps({k: v for k, v in data.items() if k != "timestamp"}, sort_keys=True)
+    return 'W/"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+
+# Fonctions helpers
+def sec_to_time(seconds):
+    if not seconds or seconds == 0:
+        return "0h00"
+    h = int(seconds // 3600)
+    m = int((seconds % 3600) // 60)
+    return f"{h}h{m:02d}"
+
+
+# Méthodes dont la réponse est une liste (valeur vide [] plutôt que {})
+LIST_METHODS = ('get_activities_by_date', 'get_activity_hr_in_timezones')
+
+
+def empty_result(method_name):
+    return [] if method_name in LIST_METHODS else {}
+
+
+def timed_get(client, method_name, *args, priority=INTERACTIVE, deadline=None):
+    """Comme safe_get sans enregistrer la mesure : retourne (résultat, outcome, durée, exception ou None).
+
+    Pour les appels lancés sur un pool : l'appelant enregistre soit ce résultat,
+    soit le timeout, jamais les deux. Sans `deadline`, l'appel a REQUEST_DEADLINE.
+    """
+    started = time.perf_counter()
+    if deadline is None:
+        deadline = time.monotonic() + REQUEST_DEADLINE
+    try:
+        if not hasattr(client, method_name):
+            return empty_result(method_name), 'missing', time.perf_counter() - started, None
+        cached, result = cached_call(client, method_name, *args, priority=priority, deadline=deadline)
+        outcome = 'cached' if cached else 'ok' if result else 'empty'
+        return (result if result is not None else empty_result(method_name)), outcome, time.perf_counter() - started, None
+    except DeadlineExceeded as e:
+        return empty_result(method_name), 'timeout', time.perf_counter() - started, e
+    except Exception as e:
+        return empty_result(method_name), type(e).__name__, time.perf_counter() - started, e
+
+
+def safe_get(client, method_name, *args, timings=None, priority=INTERACTIVE):
+    result, outcome, seconds, _ = timed_get(client, method_name, *args, priority=priority)
+    record_timing(timings, method_name, seconds, outcome, client.username)
+    return result
+
+
+def get_val(data, key, default=0):
+    if data and isinstance(data, dict):
+        val = data.get(key)
+        return val if val is not None else default
+    return default
+
+
+# NOUVELLE FONCTION pour accéder aux données imbriquées
+def get_nested_val(data, *keys, default=0):
+    """Accède aux valeurs imbriquées dans des dictionnaires"""
+    result = data
+    for key in keys:
+        if isinstance(result, dict) and key in result:
+            result = result[key]
+        else:
+            return default
+    return result if result is not None else default
+
+
+def daily_calls(date_str):
+    """Appels Garmin du mode normal : variable -> (méthode, arguments)"""
+    return {
+        "stats": ('get_stats', (date_str,)),
+        "sleep_data": ('get_sleep_data', (date_str,)),
+        "activities": ('get_activities_by_date', (date_str, date_str)),
+        "stress_data": ('get_stress_data', (date_str,)),
+        "body_battery": ('get_body_battery', (date_str, date_str)),
+        "respiration": ('get_respiration_data', (date_str,)),
+        "spo2": ('get_spo2_data', (date_str,)),
+        "hrv": ('get_hrv_data', (date_str,)),
+        "training_readiness": ('get_training_readiness', (date_str,)),
+        "training_status": ('get_training_status', (date_str,)),
+        "max_metrics": ('get_max_metrics', (date_str,)),
+        "hydration": ('get_hydration_data', (date_str,)),
+        "weight": ('get_weigh_ins', (date_str,)),
+        "body_comp": ('get_body_composition', (date_str, date_str)),
+        "blood_pressure": ('get_blood_pressure', (date_str, date_str)),
+    }
+
+
+# Résultats d'un appel qui ne signalent pas d'échec (sinon : 'timeout' ou le type d'exception)
+FETCH_OK_OUTCOMES = ('ok', 'empty', 'cached', 'missing')
+
+
+def fetch_each(client, calls, deadline=None, timings=None, priority=INTERACTIVE):
+    """Lance les appels en parallèle et retourne un itérateur de
+    (variable, résultat, outcome, durée, exception ou None) dans l'ordre où ils
+    se terminent.
+
+    Les appels encore en cours à `deadline` sont annulés et rendus avec
+    l'outcome 'timeout' et la même valeur vide que safe_get en cas d'erreur.
+    Chaque appel est enregistré une seule fois dans les mesures.
+    """
+    started = time.monotonic()
+    if deadline is None:
+        deadline = started + REQUEST_DEADLINE
+    pool = _pool if priority == INTERACTIVE else _background_pool
+    pending = {
+        pool.submit(timed_get, client, method_name, *args, priority=priority, deadline=deadline): key
+        for key, (method_name, args) in calls.items()
+    }
+    return _iter_completed(client, calls, pending, started, deadline, timings)
+
+
+def _iter_completed(client, calls, pending, started, deadline, timings):
+    while pending:
+        done, _ = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            key = pending.pop(future)
+            result, outcome, seconds, error = future.result()
+            record_timing(timings, calls[key][0], seconds, outcome, client.username)
+            yield key, result, outcome, seconds, error
+    for future, key in pending.items():
+        future.cancel()
+        seconds = time.monotonic() - started
+        record_timing(timings, calls[key][0], seconds, 'timeout', client.username)
+        yield key, empty_result(calls[key][0]), 'timeout', seconds, None
+
+
+def collect(calls, completed):
+    """Regroupe les éléments de fetch_each : (résultats par variable, méthodes hors délai, méthodes en erreur)"""
+    results = {}
+    timed_out = []
+    failed = []
+    for key, result, outcome, _, _ in completed:
+        results[key] = result
+        if outcome == 'timeout':
+            timed_out.append(calls[key][0])
+        elif outcome not in FETCH_OK_OUTCOMES:
+            failed.append(calls[key][0])
+    return results, timed_out, failed
+
+
+def fetch_all(client, calls, deadline=None, timings=None, priority=INTERACTIVE):
+    """Attend tous les appels de fetch_each.
+
+    Retourne (résultats par variable, méthodes hors délai, méthodes en erreur).
+    """
+    return collect(calls, fetch_each(client, calls, deadline, timings, priority))
+
+
+# Mode debug : les appels du mode normal, chaque payload brut envoyé dès sa réception
+FIXTURE_DIR = os.environ.get('GARMIN_FIXTURE_DIR', '/tmp/garmin_fixtures')
+
+
+def debug_calls(date_str, methods=None):
+    """Appels de daily_calls restreints à `methods` (noms de méthode ou de variable, séparés par des virgules)"""
+    calls = daily_calls(date_str)
+    if not methods:
+        return calls
+    wanted = {name.strip() for name in methods.split(',') if name.strip()}
+    unknown = wanted - set(calls) - {method_name for method_name, _ in calls.values()}
+    if unknown:
+        raise ValueError(f"Méthodes inconnues : {', '.join(sorted(unknown))}")
+    return {key: call for key, call in calls.items() if key in wanted or call[0] in wanted}
+
+
+def payload_keys(payload):
+    """Clés du payload (du premier élément pour une liste)"""
+    if isinstance(payload, list):
+        payload = payload[0] if payload else None
+    return list(payload) if isinstance(payload, dict) else None
+
+
+def record_fixture(directory, method_name, body):
+    """Écrit le payload au format de bench/fixtures (un fichier JSON par méthode)"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, method_name + '.json')
+    with open(path, 'wb') as f:
+        f.write(body)
+    return path
+
+
+def iter_debug(client, calls, record_dir=None):
+    """Génère un élément par appel dès qu'il se termine (durée, résultat, taille, clés, payload brut).
+
+    Les appels passent par fetch_each comme en mode normal (cache,
+    single-flight, scheduler, délai global) ; les payloads reçus sont
+    enregistrés dans `record_dir` si fourni.
+    """
+    started = time.monotonic()
+    timed_out = []
+    for key, payload, outcome, seconds, error in fetch_each(client, calls):
+        method_name, args = calls[key]
+        if outcome == 'timeout':
+            timed_out.append(method_name)
+            yield {"variable": key, "method": method_name, "outcome": outcome, "ms": round(seconds * 1000, 1)}
+            continue
+        if error is not None:
+            # Pas de payload : la valeur vide de repli n'est pas la réponse de Garmin
+            yield {
+                "variable": key,
+                "method": method_name,
+                "args": list(args),
+                "outcome": outcome,
+                "ms": round(seconds * 1000, 1),
+                "bytes": None,
+                "keys": None,
+                "error": str(error),
+                "traceback": "".join(traceback.format_exception(type(error), error, error.__traceback__)),
+            }
+            continue
+        body = encode_json(payload)
+        item = {
+            "variable": key,
+            "method": method_name,
+            "args": list(args),
+            "outcome": outcome,
+            "ms": round(seconds * 1000, 1),
+            "bytes": len(body),
+            "keys": payload_keys(payload),
+            "payload": payload,
+        }
+        if record_dir and outcome in ('ok', 'cached'):
+            item["fixture"] = record_fixture(record_dir, method_name, body)
+        yield item
+    yield {"done": True, "ms": round((time.monotonic() - started) * 1000, 1), "timed_out": timed_out}
+
+
+# Plages de dates : un appel Garmin par méthode "plage", découpé ensuite par jour
+RANGE_CHUNK_DAYS = 31
+RANGE_DAYS_IN_FLIGHT = int(os.environ.get('GARMIN_RANGE_DAYS_IN_FLIGHT', '3'))
+MAX_RANGE_DAYS = int(os.environ.get('GARMIN_MAX_RANGE_DAYS', '366'))
+
+
+def _group_by_day(items, day_of):
+    days = {}
+    for item in items if isinstance(items, list) else []:
+        day = day_of(item) if isinstance(item, dict) else None
+        if day:
+            days.setdefault(day[:10], []).append(item)
+    return days
+
+
+def split_activities(payload):
+    return _group_by_day(payload, lambda act: act.get('startTimeLocal'))
+
+
+def split_body_battery(payload):
+    return _group_by_day(payload, lambda entry: entry.get('date'))
+
+
+def split_body_composition(payload):
+    if not isinstance(payload, dict):
+        return {}
+    base = {k: v for k, v in payload.items() if k not in ('dateWeightList', 'totalAverage')}
+    days = _group_by_day(payload.get('dateWeightList'), lambda entry: entry.get('calendarDate'))
+    return {day: {**base, "startDate": day, "endDate": day, "dateWeightList": entries} for day, entries in days.items()}
+
+
+def split_blood_pressure(payload):
+    if not isinstance(payload, dict):
+        return {}
+    base = {k: v for k, v in payload.items() if k != 'measurementSummaries'}
+    days = _group_by_day(payload.get('measurementSummaries'), lambda entry: entry.get('startDate'))
+    return {day: {**base, "from": day, "until": day, "measurementSummaries": entries} for day, entries in days.items()}
+
+
+# Variable de daily_calls -> découpage par jour du résultat de l'appel sur la plage
+RANGED_SPLITTERS = {
+    "activities": split_activities,
+    "body_battery": split_body_battery,
+    "body_comp": split_body_composition,
+    "blood_pressure": split_blood_pressure,
+}
+
+
+def date_range(start, end):
+    day = start
+    while day <= end:
+        yield day.strftime("%Y-%m-%d")
+        day += timedelta(days=1)
+
+
+def iter_range_summaries(client, start, end, sections=None):
+    """Génère le résumé de chaque jour de [start, end], dans l'ordre, dès qu'il est complet.
+
+    La plage est traitée par tranches de RANGE_CHUNK_DAYS jours : les méthodes
+    de RANGED_SPLITTERS sont appelées une fois par tranche, les autres jour par
+    jour avec au plus RANGE_DAYS_IN_FLIGHT jours en cours. La mémoire reste
+    donc bornée quelle que soit la longueur de la plage.
+    """
+    sections = sections or list(SECTIONS)
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(end, chunk_start + timedelta(days=RANGE_CHUNK_DAYS - 1))
+        first = chunk_start.strftime("%Y-%m-%d")
+        last = chunk_end.strftime("%Y-%m-%d")
+        ranged_calls = {
+            key: (method_name, (first, last))
+            for key, (method_name, _) in calls_for_sections(first, sections).items() if key in RANGED_SPLITTERS
+        }
+        ranged_raw, ranged_timed_out, ranged_failed = fetch_all(client, ranged_calls, priority=BACKGROUND)
+        ranged = {key: RANGED_SPLITTERS[key](payload) for key, payload in ranged_raw.items()}
+
+        days = date_range(chunk_start, chunk_end)
+        pending = deque()
+
+        def start_day(day):
+            calls = {key: call for key, call in calls_for_sections(day, sections).items() if key not in RANGED_SPLITTERS}
+            pending.append((day, calls, fetch_each(client, calls, priority=BACKGROUND)))
+
+        for day in days:
+            start_day(day)
+            if len(pending) >= RANGE_DAYS_IN_FLIGHT:
+                break
+
+        while pending:
+            day, calls, completed = pending.popleft()
+            raw, timed_out, failed = collect(calls, completed)
+            for key, per_day in ranged.items():
+                raw[key] = per_day.get(day, empty_result(ranged_calls[key][0]))
+            data = build_summary(day, raw, sections)
+            if timed_out or ranged_timed_out:
+                data["timed_out"] = ranged_timed_out + timed_out
+            if failed or ranged_failed:
+                data["failed"] = ranged_failed + failed
+            yield data
+            next_day = next(days, None)
+            if next_day is not None:
+                start_day(next_day)
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+def section_basic_stats(raw):
+    stats = raw["stats"]
+    return {
+        "steps": get_val(stats, "totalSteps", 0),
+        "distance_km": round(get_val(stats, "totalDistanceMeters", 0) / 1000, 2),
+        "calories_active": get_val(stats, "activeKilocalories", 0),
+        "calories_total": get_val(stats, "totalKilocalories", 0),
+        "calories_bmr": get_val(stats, "bmrKilocalories", 0),
+        "floors_ascended": get_val(stats, "floorsAscended", 0),
+        "floors_descended": get_val(stats, "floorsDescended", 0),
+        "intensity_minutes_moderate": get_val(stats, "moderateIntensityMinutes", 0),
+        "intensity_minutes_vigorous": get_val(stats, "vigorousIntensityMinutes", 0),
+        "intensity_minutes_goal": get_val(stats, "intensityMinutesGoal", 0),
+        "steps_goal": get_val(stats, "dailyStepGoal", 0),
+    }
+
+
+def section_heart_rate(raw):
+    stats = raw["stats"]
+    hrv = raw["hrv"]
+    activities = raw["activities"]
+
+    # ✅ CORRECTION HRV - Les données sont dans hrvSummary
+    hrv_summary = hrv.get('hrvSummary', {}) if isinstance(hrv, dict) else {}
+    hrv_baseline = hrv_summary.get('baseline', {}) if isinstance(hrv_summary, dict) else {}
+
+    # FC moyenne : chercher dans les activités si pas dans stats
+    avg_hr = get_val(stats, 'averageHeartRateInBeatsPerMinute', 0)
+    if avg_hr == 0:
+        avg_hr = get_val(stats, 'avgHeartRate', 0)
+    if avg_hr == 0 and isinstance(activities, list) and len(activities) > 0:
+        hr_values = [act.get('averageHR', 0) for act in activities if act.get('averageHR', 0) > 0]
+        avg_hr = round(sum(hr_values) / len(hr_values)) if hr_values else 0
+
+    return {
+        "avg": avg_hr,
+        "resting": get_val(stats, "restingHeartRate", 0),
+        "max": get_val(stats, "maxHeartRate", 0),
+        "min": get_val(stats, "minHeartRate", 0),
+        "hrv_weekly_avg": get_val(hrv_summary, 'weeklyAvg', 0),
+        "hrv_last_night": get_val(hrv_summary, 'lastNightAvg', 0),
+        "hrv_last_night_5min_high": get_val(hrv_summary, 'lastNight5MinHigh', 0),
+        "hrv_status": get_val(hrv_summary, 'status', None),
+        "hrv_baseline_low_upper": get_val(hrv_baseline, 'lowUpper', 0),
+        "hrv_baseline_balanced_low": get_val(hrv_baseline, 'balancedLow', 0),
+        "hrv_baseline_balanced_upper": get_val(hrv_baseline, 'balancedUpper', 0),
+    }
+
+
+def section_sleep(raw):
+    sleep_data = raw["sleep_data"]
+
+    # Extraction sommeil
+    daily_sleep = sleep_data.get('dailySleepDTO', {}) if isinstance(sleep_data, dict) else {}
+    sleep_levels = sleep_data.get('sleepLevels', []) if isinstance(sleep_data, dict) else []
+    sleep_movement = sleep_data.get('sleepMovement', []) if isinstance(sleep_data, dict) else []
+
+    # Durées sommeil
+    sleep_total_sec = get_val(daily_sleep, "sleepTimeSeconds", 0)
+    sleep_deep_sec = get_val(daily_sleep, "deepSleepSeconds", 0)
+    sleep_light_sec = get_val(daily_sleep, "lightSleepSeconds", 0)
+    sleep_rem_sec = get_val(daily_sleep, "remSleepSeconds", 0)
+    sleep_awake_sec = get_val(daily_sleep, "awakeSleepSeconds", 0)
+    sleep_unmeas_sec = get_val(daily_sleep, "unmeasurableSleepSeconds", 0)
+    sleep_nap_sec = get_val(daily_sleep, "napTimeSeconds", 0)
+
+    # Sleep scores
+    sleep_scores = daily_sleep.get('sleepScores', {}) if isinstance(daily_sleep, dict) else {}
+
+    return {
+        "total_hours": round(sleep_total_sec / 3600, 2),
+        "total_formatted": sec_to_time(sleep_total_sec),
+        "deep_hours": round(sleep_deep_sec / 3600, 2),
+        "deep_formatted": sec_to_time(sleep_deep_sec),
+        "light_hours": round(sleep_light_sec / 3600, 2),
+        "light_formatted": sec_to_time(sleep_light_sec),
+        "rem_hours": round(sleep_rem_sec / 3600, 2),
+        "rem_formatted": sec_to_time(sleep_rem_sec),
+        "awake_hours": round(sleep_awake_sec / 3600, 2),
+        "awake_formatted": sec_to_time(sleep_awake_sec),
+        "unmeasurable_hours": round(sleep_unmeas_sec / 3600, 2),
+        "unmeasurable_formatted": sec_to_time(sleep_unmeas_sec),
+        "nap_time_hours": round(sleep_nap_sec / 3600, 2),
+        "nap_formatted": sec_to_time(sleep_nap_sec),
+        "sleep_score_overall": get_val(sleep_scores, 'overall', 0),
+        "sleep_score_quality": get_val(sleep_scores, 'qualityScore', 0),
+        "sleep_score_recovery": get_val(sleep_scores, 'recoveryScore', 0),
+        "sleep_score_duration": get_val(sleep_scores, 'durationScore', 0),
+        "sleep_score_feedback": get_val(daily_sleep, "sleepScoreFeedback", None),
+        "sleep_score_insight": get_val(daily_sleep, "sleepScoreInsight", None),
+        "awake_count": get_val(daily_sleep, "awakeCount", 0),
+        "avg_sleep_stress": get_val(daily_sleep, "avgSleepStress", 0),
+        "sleep_start": get_val(daily_sleep, "sleepStartTimestampLocal", None),
+        "sleep_end": get_val(daily_sleep, "sleepEndTimestampLocal", None),
+        "sleep_window_confirmed": get_val(daily_sleep, "sleepWindowConfirmed", False),
+        "avg_respiration": get_val(daily_sleep, 'averageRespirationValue', 0),
+        "lowest_respiration": get_val(daily_sleep, 'lowestRespirationValue', 0),
+        "highest_respiration": get_val(daily_sleep, 'highestRespirationValue', 0),
+        "avg_spo2_sleep": get_val(daily_sleep, 'averageSpO2Value', 0),
+        "sleep_levels_count": len(sleep_levels),
+        "sleep_movements_count": len(sleep_movement),
+    }
+
+
+def section_body_battery(raw):
+    stats = raw["stats"]
+    body_battery = raw["body_battery"]
+    return {
+        "charged": get_val(stats, "bodyBatteryChargedValue", 0),
+        "drained": get_val(stats, "bodyBatteryDrainedValue", 0),
+        "highest": get_val(stats, "bodyBatteryHighestValue", 0),
+        "lowest": get_val(stats, "bodyBatteryLowestValue", 0),
+        "current": body_battery[-1].get("charged", 0) if isinstance(body_battery, list) and len(body_battery) > 0 else 0,
+    }
+
+
+def section_stress(raw):
+    stats = raw["stats"]
+    return {
+        "avg": get_val(stats, "averageStressLevel", 0),
+        "max": get_val(stats, "maxStressLevel", 0),
+        "rest_stress_duration": get_val(stats, "restStressDuration", 0),
+        "activity_stress_duration": get_val(stats, "activityStressDuration", 0),
+        "low_stress_duration": get_val(stats, "lowStressDuration", 0),
+        "medium_stress_duration": get_val(stats, "mediumStressDuration", 0),
+        "high_stress_duration": get_val(stats, "highStressDuration", 0),
+    }
+
+
+def section_respiration(raw):
+    stats = raw["stats"]
+    return {
+        "avg_waking": get_val(stats, 'avgWakingRespirationValue', 0),
+        "highest": get_val(stats, 'highestRespirationValue', 0),
+        "lowest": get_val(stats, 'lowestRespirationValue', 0),
+    }
+
+
+def section_spo2(raw):
+    spo2 = raw["spo2"]
+    # ✅ CORRECTION SPO2 - Les noms corrects
+    return {
+        "avg": get_val(spo2, 'averageSpO2', 0),
+        "lowest": get_val(spo2, 'lowestSpO2', 0),
+        "avg_sleep": get_val(spo2, 'avgSleepSpO2', 0),
+        "last_7_days_avg": get_val(spo2, 'lastSevenDaysAvgSpO2', 0),
+    }
+
+
+def section_training(raw):
+    training_readiness = raw["training_readiness"]
+    training_status = raw["training_status"]
+    max_metrics = raw["max_metrics"]
+
+    # ✅ CORRECTION Training Readiness - C'est une LISTE !
+    if isinstance(training_readiness, list) and len(training_readiness) > 0:
+        tr_data = training_readiness[0]
+        readiness_score = get_val(tr_data, 'score', 0)
+        readiness_level = get_val(tr_data, 'level', None)
+        readiness_feedback_short = get_val(tr_data, 'feedbackShort', None)
+        readiness_feedback_long = get_val(tr_data, 'feedbackLong', None)
+        readiness_sleep_score = get_val(tr_data, 'sleepScore', 0)
+        readiness_recovery_time = get_val(tr_data, 'recoveryTime', 0)
+        readiness_hrv_weekly = get_val(tr_data, 'hrvWeeklyAverage', 0)
+    else:
+        readiness_score = 0
+        readiness_level = None
+        readiness_feedback_short = None
+        readiness_feedback_long = None
+        readiness_sleep_score = 0
+        readiness_recovery_time = 0
+        readiness_hrv_weekly = 0
+
+    return {
+        "readiness_score": readiness_score,
+        "readiness_level": readiness_level,
+        "readiness_feedback_short": readiness_feedback_short,
+        "readiness_feedback_long": readiness_feedback_long,
+        "readiness_sleep_score": readiness_sleep_score,
+        "readiness_recovery_time_hours": round(readiness_recovery_time / 3600, 2) if readiness_recovery_time else 0,
+        "readiness_hrv_weekly_avg": readiness_hrv_weekly,
+        "training_status": get_val(training_status, 'trainingStatus', None),
+        "vo2_max": get_val(max_metrics, 'vo2MaxValue', 0),
+        "fitness_age": get_val(max_metrics, 'fitnessAge', 0),
+    }
+
+
+def activity_summary(act):
+    return {
+        "name": act.get("activityName", ""),
+        "type": act.get("activityType", {}).get("typeKey", "") if isinstance(act.get("activityType"), dict) else "",
+        "duration_minutes": round(act.get("duration", 0) / 60, 2),
+        "duration_formatted": sec_to_time(act.get("duration", 0)),
+        "distance_km": round(act.get("distance", 0) / 1000, 2),
+        "calories": act.get("calories", 0),
+        "avg_hr": act.get("averageHR", 0),
+        "max_hr": act.get("maxHR", 0),
+        "avg_speed": round(act.get("averageSpeed", 0) * 3.6, 2),
+        "elevation_gain": act.get("elevationGain", 0),
+        "elevation_loss": act.get("elevationLoss", 0),
+        "avg_cadence": act.get("averageRunningCadenceInStepsPerMinute", 0),
+        "max_cadence": act.get("maxRunningCadenceInStepsPerMinute", 0),
+    }
+
+
+def section_activities(raw):
+    activities = raw["activities"]
+    return {
+        "count": len(activities) if isinstance(activities, list) else 0,
+        "list": [activity_summary(act) for act in (activities[:20] if isinstance(activities, list) else [])]
+    }
+
+
+def section_body_composition(raw):
+    weight = raw["weight"]
+    body_comp = raw["body_comp"]
+    return {
+        "weight_kg": round(get_val(weight, "weight", 0) / 1000, 2) if get_val(weight, "weight", 0) > 0 else 0,
+        "bmi": get_val(body_comp, "bmi", 0),
+        "body_fat_percentage": get_val(body_comp, "bodyFat", 0),
+        "body_water_percentage": get_val(body_comp, "bodyWater", 0),
+        "bone_mass_kg": get_val(body_comp, "boneMass", 0),
+        "muscle_mass_kg": get_val(body_comp, "muscleMass", 0),
+        "metabolic_age": get_val(body_comp, "metabolicAge", 0),
+        "visceral_fat": get_val(body_comp, "visceralFat", 0),
+    }
+
+
+def section_hydration(raw):
+    hydration = raw["hydration"]
+    return {
+        "total_ml": get_val(hydration, 'valueInML', None),
+        "goal_ml": get_val(hydration, 'goalInML', 0),
+        "sweat_loss_ml": get_val(hydration, 'sweatLossInML', None),
+    }
+
+
+def section_blood_pressure(raw):
+    blood_pressure = raw["blood_pressure"]
+    return {
+        "systolic": (
+            blood_pressure[0].get("systolic", 0) if isinstance(blood_pressure, list) and len(blood_pressure) > 0 
+            else get_val(blood_pressure, "systolic", 0) if isinstance(blood_pressure, dict) 
+            else 0
+        ),
+        "diastolic": (
+            blood_pressure[0].get("diastolic", 0) if isinstance(blood_pressure, list) and len(blood_pressure) > 0 
+            else get_val(blood_pressure, "diastolic", 0) if isinstance(blood_pressure, dict) 
+            else 0
+        ),
+        "pulse": (
+            blood_pressure[0].get("pulse", 0) if isinstance(blood_pressure, list) and len(blood_pressure) > 0 
+            else get_val(blood_pressure, "pulse", 0) if isinstance(blood_pressure, dict) 
+            else 0
+        ),
+    }
+
+
+# Section de la réponse -> (variables de daily_calls nécessaires, construction)
+SECTIONS = {
+    "basic_stats": (("stats",), section_basic_stats),
+    "heart_rate": (("stats", "hrv", "activities"), section_heart_rate),
+    "sleep": (("sleep_data",), section_sleep),
+    "body_battery": (("stats", "body_battery"), section_body_battery),
+    "stress": (("stats",), section_stress),
+    "respiration": (("stats",), section_respiration),
+    "spo2": (("spo2",), section_spo2),
+    "training": (("training_readiness", "training_status", "max_metrics"), section_training),
+    "activities": (("activities",), section_activities),
+    "body_composition": (("weight", "body_comp"), section_body_composition),
+    "hydration": (("hydration",), section_hydration),
+    "blood_pressure": (("blood_pressure",), section_blood_pressure),
+}
+
+
+def parse_sections(value):
+    """?sections=sleep,heart_rate -> liste de sections (vide = toutes)"""
+    if not value:
+        return list(SECTIONS)
+    sections = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in sections if name not in SECTIONS]
+    if unknown:
+        raise ValueError(f"Section inconnue : {', '.join(unknown)}")
+    return sections
+
+
+def calls_for_sections(date_str, sections):
+    """Seuls les appels Garmin dont dépendent les sections demandées"""
+    needed = {key for name in sections for key in SECTIONS[name][0]}
+    return {key: call for key, call in daily_calls(date_str).items() if key in needed}
+
+
+def build_summary(date_str, raw, sections=None):
+    """Construit la réponse du mode normal à partir des données brutes"""
+    data = {
+        "date": date_str,
+        "timestamp": datetime.now().isoformat(),
+    }
+    for name in sections or SECTIONS:
+        data[name] = SECTIONS[name][1](raw)
+    return data
+
+# Historique local : un ligne par jour et par compte, une colonne par métrique
+HISTORY_DB = os.environ.get('GARMIN_HISTORY_DB', '/tmp/garmin_history.sqlite')
+HISTORY_MUTABLE_DAYS = 2
+SYNC_DEFAULT_DAYS = int(os.environ.get('GARMIN_SYNC_DEFAULT_DAYS', '365'))
+# Plus longue période acceptée par /api/sync et /api/trends
+HISTORY_MAX_DAYS = int(os.environ.get('GARMIN_HISTORY_MAX_DAYS', '3660'))
+
+# Métrique de tendance -> (section, champ) du résumé quotidien
+TREND_METRICS = {
+    "resting_hr": ("heart_rate", "resting"),
+    "hrv_last_night": ("heart_rate", "hrv_last_night"),
+    "hrv_weekly_avg": ("heart_rate", "hrv_weekly_avg"),
+    "hrv_baseline_low": ("heart_rate", "hrv_baseline_balanced_low"),
+    "hrv_baseline_upper": ("heart_rate", "hrv_baseline_balanced_upper"),
+    "sleep_score": ("sleep", "sleep_score_overall"),
+    "sleep_hours": ("sleep", "total_hours"),
+    "vo2_max": ("training", "vo2_max"),
+    "readiness_score": ("training", "readiness_score"),
+    "steps": ("basic_stats", "steps"),
+    "stress_avg": ("stress", "avg"),
+    "body_battery_highest": ("body_battery", "highest"),
+}
+HISTORY_SECTIONS = sorted({section for section, _ in TREND_METRICS.values()})
+
+
+def trend_value(data, section, field):
+    """Valeur numérique d'une métrique (None si absente : build_summary met 0 par défaut,
+    Garmin des valeurs négatives comme -1/-2 pour "non mesuré")"""
+    value = data.get(section, {}).get(field)
+    if isinstance(value, dict):
+        value = value.get('value')
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        return None
+    return value
+
+
+class HistoryStore:
+    """Table SQLite `daily` (compte, date, métriques de TREND_METRICS)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+
+    def _connect(self):
+        if self.db is None:
+            try:
+                self.db = sqlite3.connect(self.path, check_same_thread=False)
+                columns = ", ".join(f"{name} REAL" for name in TREND_METRICS)
+                self.db.execute(f"CREATE TABLE IF NOT EXISTS daily (account TEXT, date TEXT, final INTEGER, {columns}, PRIMARY KEY (account, date))")
+                for name in TREND_METRICS:
+                    try:
+                        self.db.execute(f"ALTER TABLE daily ADD COLUMN {name} REAL")
+                    except sqlite3.OperationalError:
+                        pass
+            except sqlite3.Error:
+                # Disque indisponible : historique vide, la sync ne stocke rien
+                self.db = False
+        return self.db
+
+    def _query(self, sql, params):
+        with self.lock:
+            db = self._connect()
+            try:
+                return db.execute(sql, params).fetchall() if db else []
+            except sqlite3.Error:
+                return []
+
+    def final_dates(self, account, first, last):
+        """Jours déjà stockés et qui ne changeront plus"""
+        rows = self._query("SELECT date FROM daily WHERE account = ? AND date BETWEEN ? AND ? AND final = 1", (account, first, last))
+        return {row[0] for row in rows}
+
+    def save(self, account, data):
+        """Stocke les métriques du jour ; retourne False si le disque l'empêche"""
+        day = datetime.strptime(data["date"], "%Y-%m-%d").date()
+        final = int((datetime.now().date() - day).days >= HISTORY_MUTABLE_DAYS)
+        values = [trend_value(data, *TREND_METRICS[name]) for name in TREND_METRICS]
+        placeholders = ", ".join("?" for _ in range(len(values) + 3))
+        with self.lock:
+            db = self._connect()
+            if not db:
+                return False
+            try:
+                db.execute(f"INSERT OR REPLACE INTO daily (account, date, final, {', '.join(TREND_METRICS)}) VALUES ({placeholders})", [account, data["date"], final] + values)
+                db.commit()
+            except sqlite3.Error:
+                return False
+        return True
+
+    def column(self, account, metric, first, last):
+        """(dates, valeurs) d'une métrique, triées par date"""
+        rows = self._query(f"SELECT date, {metric} FROM daily WHERE account = ? AND date BETWEEN ? AND ? ORDER BY date", (account, first, last))
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    def first_date(self, account):
+        rows = self._query("SELECT MIN(date) FROM daily WHERE account = ?", (account,))
+        return rows[0][0] if rows else None
+
+
+history_store = HistoryStore(HISTORY_DB)
+
+
+def iter_sync(client, start, end):
+    """Synchronise l'historique : seuls les jours absents ou encore modifiables sont récupérés.
+
+    Les jours à récupérer sont regroupés en plages contiguës passées à
+    iter_range_summaries ; génère une ligne de progression par jour. Un jour
+    dont un appel a échoué ou dépassé le délai n'est pas stocké : la sync
+    suivante le récupère à nouveau.
+    """
+    account = client.username
+    final = history_store.final_dates(account, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+    runs = []
+    for day in date_range(start, end):
+        if day in final:
+            continue
+        day = datetime.strptime(day, "%Y-%m-%d")
+        if runs and runs[-1][1] + timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    synced = 0
+    incomplete = 0
+    for run_start, run_end in runs:
+        for data in iter_range_summaries(client, run_start, run_end, HISTORY_SECTIONS):
+            timed_out = data.get("timed_out", [])
+            failed = data.get("failed", [])
+            stored = not timed_out and not failed and history_store.save(account, data)
+            if stored:
+                synced += 1
+            else:
+                incomplete += 1
+            yield {"date": data["date"], "stored": stored, "timed_out": timed_out, "failed": failed}
+    yield {"synced": synced, "skipped": len(final), "incomplete": incomplete}
+
+
+def _rolling_sums(values, window):
+    """Sommes, sommes des carrés et effectifs glissants (NaN ignorés), via cumsum"""
+    import numpy as np
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    csum = np.concatenate(([0.0], np.cumsum(filled)))
+    csq = np.concatenate(([0.0], np.cumsum(filled * filled)))
+    ccount = np.concatenate(([0], np.cumsum(valid)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    return csum[end] - csum[start], csq[end] - csq[start], ccount[end] - ccount[start]
+
+
+def compute_trend(dates, values, first, last, window, baseline_window):
+    """Moyenne glissante, percentiles et bande de référence (moyenne ± écart-type) sur [first, last]"""
+    import numpy as np
+    start = np.datetime64(first, 'D')
+    size = int((np.datetime64(last, 'D') - start).astype(int)) + 1
+    series = np.full(size, np.nan)
+    if dates:
+        offsets = (np.array(dates, dtype='datetime64[D]') - start).astype(int)
+        series[offsets] = np.array(values, dtype=float)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sums, _, counts = _rolling_sums(series, window)
+        rolling = sums / counts
+        bsums, bsq, bcounts = _rolling_sums(series, baseline_window)
+        bmean = bsums / bcounts
+        bstd = np.sqrt(np.maximum(bsq / bcounts - bmean * bmean, 0))
+
+    def as_list(array):
+        return np.where(np.isnan(array), None, np.round(array, 2)).tolist()
+
+    measured = series[~np.isnan(series)]
+    percentiles = dict(zip(("p10", "p25", "p50", "p75", "p90"), np.round(np.percentile(measured, [10, 25, 50, 75, 90]), 2).tolist())) if measured.size else {}
+    return {
+        "dates": np.arange(start, start + size).astype(str).tolist(),
+        "values": as_list(series),
+        "rolling_mean": as_list(rolling),
+        "baseline_low": as_list(bmean - bstd),
+        "baseline_high": as_list(bmean + bstd),
+        "percentiles": percentiles,
+        "count": int(measured.size),
+    }
+
+
+# Séries intraday : tableaux parallèles timestamps (ms) / valeurs, réduits par LTTB
+SERIES_DEFAULT_POINTS = 200
+SERIES_MAX_POINTS = 5000
+
+
+def _value_pairs(rows, value_index=1):
+    """[[timestamp_ms, valeur, ...], ...] -> tableaux NumPy, valeurs absentes ou négatives exclues"""
+    import numpy as np
+    rows = [row for row in rows or [] if isinstance(row, list) and len(row) > value_index
+            and isinstance(row[value_index], (int, float)) and row[value_index] >= 0]
+    timestamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((row[value_index] for row in rows), dtype=np.float64, count=len(rows))
+    return timestamps, values
+
+
+def _level_pairs(rows):
+    """[{"startGMT": ..., "activityLevel": ...}, ...] -> tableaux NumPy"""
+    import numpy as np
+    rows = [row for row in rows or [] if isinstance(row, dict) and row.get('startGMT') and isinstance(row.get('activityLevel'), (int, float))]
+    starts = np.array([row['startGMT'][:19] for row in rows], dtype='datetime64[ms]')
+    return starts.astype(np.int64), np.fromiter((row['activityLevel'] for row in rows), dtype=np.float64, count=len(rows))
+
+
+def series_stress(payload):
+    return _value_pairs(payload.get('stressValuesArray') if isinstance(payload, dict) else None)
+
+
+def series_body_battery(payload):
+    day = payload[0] if isinstance(payload, list) and payload else {}
+    return _value_pairs(day.get('bodyBatteryValuesArray') if isinstance(day, dict) else None)
+
+
+def series_respiration(payload):
+    return _value_pairs(payload.get('respirationValuesArray') if isinstance(payload, dict) else None)
+
+
+def series_sleep_levels(payload):
+    return _level_pairs(payload.get('sleepLevels') if isinstance(payload, dict) else None)
+
+
+def series_sleep_movement(payload):
+    return _level_pairs(payload.get('sleepMovement') if isinstance(payload, dict) else None)
+
+
+def series_heart_rate(payload):
+    return _value_pairs(payload.get('heartRateValues') if isinstance(payload, dict) else None)
+
+
+# Série -> (méthode Garmin, arguments selon la date, extraction)
+SERIES = {
+    "stress": ('get_stress_data', lambda d: (d,), series_stress),
+    "body_battery": ('get_body_battery', lambda d: (d, d), series_body_battery),
+    "respiration": ('get_respiration_data', lambda d: (d,), series_respiration),
+    "sleep_levels": ('get_sleep_data', lambda d: (d,), series_sleep_levels),
+    "sleep_movement": ('get_sleep_data', lambda d: (d,), series_sleep_movement),
+    "heart_rate": ('get_heart_rates', lambda d: (d,), series_heart_rate),
+}
+
+
+def lttb(timestamps, values, points):
+    """Largest-Triangle-Three-Buckets : garde `points` points en préservant la forme de la courbe"""
+    import numpy as np
+    size = len(values)
+    if points >= size or points < 3:
+        return timestamps, values
+    x = timestamps.astype(np.float64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    # Bornes des seaux intérieurs (le premier et le dernier point sont conservés)
+    edges = np.floor(np.linspace(1, size - 1, points - 1)).astype(np.int64)
+    previous = 0
+    for i in range(points - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else size)
+        next_end = max(next_end, next_start + 1)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = values[next_start:next_end].mean()
+        area = np.abs((x[previous] - avg_x) * (values[start:end] - values[previous])
+                      - (x[previous] - x[start:end]) * (avg_y - values[previous]))
+        previous = start + int(area.argmax())
+        selected[i + 1] = previous
+    return timestamps[selected], values[selected]
+
+
+def build_series(metric, date_str, payload, points):
+    timestamps, values = SERIES[metric][2](payload)
+    source_points = len(values)
+    timestamps, values = lttb(timestamps, values, points)
+    return {
+        "metric": metric,
+        "date": date_str,
+        "source_points": source_points,
+        "points": len(values),
+        "timestamps": timestamps.tolist(),
+        "values": values.tolist(),
+    }
+
+
+# Export des activités : pages triées par (startTimeLocal, activityId), détails par activité
+ACTIVITY_PAGE_SIZE = int(os.environ.get('GARMIN_ACTIVITY_PAGE_SIZE', '50'))
+ACTIVITY_MAX_PAGE_SIZE = 200
+ACTIVITIES_IN_FLIGHT = int(os.environ.get('GARMIN_ACTIVITIES_IN_FLIGHT', '4'))
+
+# Détail -> méthode Garmin appelée avec l'activityId (cache permanent, voir IMMUTABLE_METHODS)
+ACTIVITY_DETAILS = {
+    "laps": 'get_activity_splits',
+    "splits": 'get_activity_split_summaries',
+    "hr_zones": 'get_activity_hr_in_timezones',
+}
+
+
+def activity_key(act):
+    return [act.get("startTimeLocal") or "", act.get("activityId") or 0]
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Clé (startTimeLocal, activityId) de la dernière activité de la page précédente"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        datetime.strptime(key[0][:10], "%Y-%m-%d")
+        return [key[0], int(key[1])]
+    except (ValueError, TypeError, IndexError, KeyError):
+        raise ValueError("Curseur invalide")
+
+
+def activity_page(client, start, end, after=None, limit=ACTIVITY_PAGE_SIZE):
+    """Activités de [start, end] strictement après la clé `after`, au plus `limit`.
+
+    La plage est lue par tranches de RANGE_CHUNK_DAYS jours alignées sur
+    `start` (un appel get_activities_by_date chacune, donc partagé en cache
+    entre les pages), à partir de la tranche du curseur. Une tranche en erreur
+    ou hors délai arrête la page : le curseur reprend à cette tranche.
+    Retourne (activités, curseur de la page suivante ou None, outcome de la
+    tranche en échec ou None).
+    """
+    chunk_start = start
+    if after:
+        skipped = (datetime.strptime(after[0][:10], "%Y-%m-%d") - start).days // RANGE_CHUNK_DAYS
+        chunk_start += timedelta(days=max(0, skipped) * RANGE_CHUNK_DAYS)
+    page = []
+    while chunk_start <= end:
+        chunk_end = min(end, chunk_start + timedelta(days=RANGE_CHUNK_DAYS - 1))
+        activities, outcome, seconds, _ = timed_get(client, 'get_activities_by_date', chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d"), priority=BACKGROUND)
+        record_timing(None, 'get_activities_by_date', seconds, outcome, client.username)
+        if outcome not in FETCH_OK_OUTCOMES:
+            # Jamais de curseur au-delà d'une tranche manquante
+            if page:
+                resume = activity_key(page[-1])
+            else:
+                resume = after or [chunk_start.strftime("%Y-%m-%d"), 0]
+            return page, encode_cursor(resume), outcome
+        activities = sorted((act for act in activities if isinstance(act, dict)), key=activity_key)
+        page.extend(act for act in activities if after is None or activity_key(act) > after)
+        if len(page) > limit:
+            break
+        chunk_start = chunk_end + timedelta(days=1)
+    if len(page) > limit:
+        return page[:limit], encode_cursor(activity_key(page[limit - 1])), None
+    return page, None, None
+
+
+def iter_activities(client, start, end, after=None, limit=ACTIVITY_PAGE_SIZE):
+    """Génère chaque activité de la page avec ses détails, dans l'ordre, puis le curseur suivant
+    (avec `failed` ou `timed_out` si la liste des activités n'a pas pu être lue jusqu'au bout).
+
+    Les détails sont récupérés pour au plus ACTIVITIES_IN_FLIGHT activités à la
+    fois, avec un délai de REQUEST_DEADLINE par activité.
+    """
+    activities, next_cursor, chunk_outcome = activity_page(client, start, end, after, limit)
+    remaining = iter(activities)
+    pending = deque()
+
+    def start_activity(act):
+        calls = {
+            name: (method_name, (act["activityId"],))
+            for name, method_name in ACTIVITY_DETAILS.items()
+        } if act.get("activityId") else {}
+        pending.append((act, calls, fetch_each(client, calls, priority=BACKGROUND)))
+
+    for act in remaining:
+        start_activity(act)
+        if len(pending) >= ACTIVITIES_IN_FLIGHT:
+            break
+
+    while pending:
+        act, calls, completed = pending.popleft()
+        details, timed_out, failed = collect(calls, completed)
+        item = {"id": act.get("activityId"), "start": act.get("startTimeLocal"), **activity_summary(act), **details}
+        if timed_out:
+            item["timed_out"] = timed_out
+        if failed:
+            item["failed"] = failed
+        yield item
+        next_act = next(remaining, None)
+        if next_act is not None:
+            start_activity(next_act)
+    last = {"count": len(activities), "next_cursor": next_cursor}
+    if chunk_outcome == 'timeout':
+        last["timed_out"] = ['get_activities_by_date']
+    elif chunk_outcome is not None:
+        last["failed"] = ['get_activities_by_date']
+    yield last
+
+
+# Encodage des réponses
+COMPRESS_MIN_BYTES = 512
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def encode_json(data, pretty=False):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode()
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def negotiate(headers, pretty=False):
+    """Choisit (content-type, compression) selon Accept et Accept-Encoding"""
+    accept = headers.get('Accept', '') or ''
+    accept_encoding = headers.get('Accept-Encoding', '') or ''
+    encodings = set()
+    for part in accept_encoding.split(','):
+        name, _, q = part.strip().partition(';')
+        if name and q.replace(' ', '') not in ('q=0', 'q=0.0'):
+            encodings.add(name.strip().lower())
+    if msgpack is not None and any(t in accept for t in MSGPACK_TYPES):
+        content_type = 'application/msgpack'
+    else:
+        content_type = 'application/json'
+    if brotli is not None and 'br' in encodings:
+        compression = 'br'
+    elif 'gzip' in encodings:
+        compression = 'gzip'
+    else:
+        compression = None
+    return content_type, compression
+
+
+def encode_body(data, content_type, pretty=False):
+    if content_type == 'application/msgpack':
+        return msgpack.packb(data)
+    return encode_json(data, pretty)
+
+
+class StreamWriter:
+    """Écrit une réponse morceau par morceau dans wfile, compressée au fil de l'eau"""
+
+    def __init__(self, wfile, compression):
+        self.wfile = wfile
+        self.compression = compression
+        if compression == 'gzip':
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif compression == 'br':
+            self.compressor = brotli.Compressor()
+        else:
+            self.compressor = None
+
+    def write(self, chunk, flush=True):
+        if self.compression == 'gzip':
+            chunk = self.compressor.compress(chunk)
+            if flush:
+                chunk += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        elif self.compression == 'br':
+            chunk = self.compressor.process(chunk)
+            if flush:
+                chunk += self.compressor.flush()
+        if chunk:
+            self.wfile.write(chunk)
+        if flush:
+            self.wfile.flush()
+
+    def close(self):
+        if self.compression == 'gzip':
+            self.wfile.write(self.compressor.flush())
+        elif self.compression == 'br':
+            self.wfile.write(self.compressor.finish())
+        self.wfile.flush()
+
 
 class handler(BaseHTTPRequestHandler):
+    pretty = False
+    timings = None
+
+    def send_timing_header(self):
+        if self.timings:
+            self.send_header('Server-Timing', server_timing(self.timings))
+
+    def send_text(self, status, text, content_type='text/plain; charset=utf-8'):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_data(self, status, data, etag=None):
+        """Envoie `data` en JSON compact (?pretty=1 indenté) ou msgpack, compressé si accepté"""
+        if etag and etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        content_type, compression = negotiate(self.headers)
+        body = encode_body(data, content_type, self.pretty)
+        if len(body) < COMPRESS_MIN_BYTES:
+            compression = None
+        if compression == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        elif compression == 'br':
+            body = brotli.compress(body)
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Vary', 'Accept, Accept-Encoding, X-API-Key')
+        if compression:
+            self.send_header('Content-Encoding', compression)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_timing_header()
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, items):
+        """Envoie chaque élément dès qu'il est prêt (NDJSON ou suite d'objets msgpack)"""
+        content_type, compression = negotiate(self.headers)
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson' if content_type == 'application/json' else content_type)
+        self.send_header('Vary', 'Accept, Accept-Encoding, X-API-Key')
+        if compression:
+            self.send_header('Content-Encoding', compression)
+        self.send_timing_header()
+        if self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1':
+            # Longueur inconnue : la fin de la connexion marque la fin du flux
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        writer = StreamWriter(self.wfile, compression)
+        try:
+            for item in items:
+                writer.write(msgpack.packb(item) if content_type == 'application/msgpack' else encode_json(item) + b"\n")
+        except Exception as e:
+            # Les en-têtes sont déjà partis : l'erreur devient le dernier élément
+            error = {"error": str(e), "type": type(e).__name__}
+            writer.write(msgpack.packb(error) if content_type == 'application/msgpack' else encode_json(error) + b"\n")
+        writer.close()
+
     def do_GET(self):
         try:
             parsed_url = urlparse(self.path)
             params = parse_qs(parsed_url.query)
+            self.pretty = params.get('pretty', [''])[0] in ('1', 'true')
+            self.timings = []
+            # Compte de la requête : en-tête X-API-Key (jamais dans l'URL, qui finit dans les logs),
+            # sinon GARMIN_EMAIL/GARMIN_PASSWORD
+            api_key = self.headers.get('X-API-Key')
+            credentials = resolve_account(api_key)
+            
+            # MODE HEALTH : ne charge ni garminconnect ni la session
+            if parsed_url.path.rstrip('/').endswith('/health'):
+                self.send_data(200, {"status": "ok", "garminconnect_loaded": 'garminconnect' in sys.modules})
+                return
+            
+            # MODE METRICS : latences et erreurs par méthode Garmin (format Prometheus)
+            if parsed_url.path.rstrip('/').endswith('/metrics'):
+                self.send_text(200, METRICS.prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+                return
+            
+            # MODE SESSION : compteurs de réutilisation des tokens
+            if parsed_url.path.rstrip('/').endswith('/session'):
+                by_account = METRICS.sessions()
+                stats = {kind: sum(counts[kind] for counts in by_account.values()) for kind in SESSION_KINDS}
+                stats["by_account"] = by_account
+                stats["token_dir"] = TOKEN_DIR
+                stats["accounts"] = len(ACCOUNTS)
+                stats["pooled_clients"] = len(client_pool.snapshot())
+                stats["pool_size"] = CLIENT_POOL_SIZE
+                self.send_data(200, stats)
+                return
+            
+            # MODE TENDANCES : /api/trends?metric=resting_hr&from=...&to=...&window=7, sans appel Garmin
+            if parsed_url.path.rstrip('/').endswith('/trends'):
+                metric = params.get('metric', [''])[0]
+                if metric not in TREND_METRICS:
+                    self.send_data(400, {"error": "Métrique inconnue", "metrics": list(TREND_METRICS)})
+                    return
+                if credentials is None:
+                    if api_key:
+                        self.send_data(401, {"error": "Clé d'API inconnue"})
+                    else:
+                        self.send_data(400, {"error": "Identifiants non configurés"})
+                    return
+                account = credentials[0]
+                try:
+                    last = params['to'][0] if 'to' in params else datetime.now().strftime("%Y-%m-%d")
+                    last_day = datetime.strptime(last, "%Y-%m-%d")
+                    if 'from' in params:
+                        first = params['from'][0]
+                    else:
+                        # Par défaut tout l'historique, dans la limite de HISTORY_MAX_DAYS
+                        oldest = (last_day - timedelta(days=HISTORY_MAX_DAYS - 1)).strftime("%Y-%m-%d")
+                        first = max(history_store.first_date(account) or last, oldest)
+                    first_day = datetime.strptime(first, "%Y-%m-%d")
+                    window = int(params.get('window', ['7'])[0])
+                    baseline_window = int(params.get('baseline', ['28'])[0])
+                except ValueError:
+                    self.send_data(400, {"error": "Paramètres invalides (from/to YYYY-MM-DD, window/baseline entiers)"})
+                    return
+                if first > last or (last_day - first_day).days >= HISTORY_MAX_DAYS or window < 1 or baseline_window < 1:
+                    self.send_data(400, {"error": f"Paramètres invalides (from <= to, max {HISTORY_MAX_DAYS} jours, window/baseline >= 1)"})
+                    return
+                dates, values = history_store.column(account, metric, first, last)
+                trend = compute_trend(dates, values, first, last, window, baseline_window)
+                self.send_data(200, {"metric": metric, "from": first, "to": last, "window": window, "baseline_window": baseline_window, **trend})
+                return
             
-            # MODE DEBUG
+            # MODE DEBUG : ?debug=1&methods=get_stats,hrv&record=1, payloads bruts en NDJSON au fil des appels
             if 'debug' in params:
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                
-                email = os.environ.get('GARMIN_EMAIL')
-                password = os.environ.get('GARMIN_PASSWORD')
-                
-                if not email or not password:
-                    self.wfile.write(json.dumps({"error": "Credentials missing"}).encode())
+                if credentials is None:
+                    if api_key:
+                        self.send_data(401, {"error": "Clé d'API inconnue"})
+                    else:
+                        self.send_data(200, {"error": "Credentials missing"})
                     return
+                email, password = credentials
                 
                 date_str = params['date'][0] if 'date' in params and params['date'][0] else datetime.now().strftime("%Y-%m-%d")
+                try:
+                    datetime.strptime(date_str, "%Y-%m-%d")
+                    calls = debug_calls(date_str, params['methods'][0] if 'methods' in params else None)
+                except ValueError as e:
+                    self.send_data(400, {"error": str(e), "methods": [method_name for method_name, _ in daily_calls(date_str).values()]})
+                    return
+                record_dir = os.path.join(FIXTURE_DIR, date_str) if params.get('record', [''])[0] in ('1', 'true') else None
                 
                 try:
-                    client = Garmin(email, password)
-                    client.login()
-                    
-                    # Récupérer toutes les données brutes
-                    stats = client.get_stats(date_str)
-                    sleep_data = client.get_sleep_data(date_str)
-                    hrv = client.get_hrv_data(date_str)
-                    spo2 = client.get_spo2_data(date_str)
-                    training_readiness = client.get_training_readiness(date_str)
-                    max_metrics = client.get_max_metrics(date_str)
-                    
-                    debug_response = {
-                        "DEBUG_MODE": True,
-                        "date": date_str,
-                        "stats_keys": list(stats.keys()) if isinstance(stats, dict) else None,
-                        "stats_sample": {k: stats.get(k) for k in ['averageHeartRateInBeatsPerMinute', 'avgHeartRate', 'averageHR'] if k in stats} if isinstance(stats, dict) else None,
-                        "sleep_keys": list(sleep_data.keys()) if isinstance(sleep_data, dict) else None,
-                        "daily_sleep_keys": list(sleep_data.get('dailySleepDTO', {}).keys()) if isinstance(sleep_data, dict) else None,
-                        "hrv_keys": list(hrv.keys()) if isinstance(hrv, dict) else None,
-                        "hrv_full": hrv,
-                        "spo2_keys": list(spo2.keys()) if isinstance(spo2, dict) else None,
-                        "spo2_full": spo2,
-                        "training_readiness_keys": list(training_readiness.keys()) if isinstance(training_readiness, dict) else None,
-                        "training_readiness_full": training_readiness,
-                        "max_metrics_keys": list(max_metrics.keys()) if isinstance(max_metrics, dict) else None,
-                        "max_metrics_full": max_metrics,
-                    }
-                    
-                    self.wfile.write(json.dumps(debug_response, indent=2).encode())
+                    client = get_client(email, password, self.timings)
                 except Exception as e:
                     error_debug = {
                         "DEBUG_MODE": True,
                         "error": str(e),
                         "traceback": traceback.format_exc()
                     }
-                    self.wfile.write(json.dumps(error_debug, indent=2).encode())
+                    self.send_data(200, error_debug)
+                    return
+                self.send_stream(iter_debug(client, calls, record_dir))
                 return
             
             # MODE NORMAL
-            email = os.environ.get('GARMIN_EMAIL')
-            password = os.environ.get('GARMIN_PASSWORD')
-            
-            if not email or not password:
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "Identifiants non configurés"}).encode())
+            if credentials is None:
+                if api_key:
+                    self.send_data(401, {"error": "Clé d'API inconnue"})
+                else:
+                    self.send_data(400, {"error": "Identifiants non configurés"})
                 return
+            email, password = credentials
             
-            date_str = params['date'][0] if 'date' in params and params['date'][0] else datetime.now().strftime("%Y-%m-%d")
-            
+            # Projection : ?sections=sleep,heart_rate ne récupère que les appels nécessaires
             try:
-                datetime.strptime(date_str, "%Y-%m-%d")
-            except ValueError:
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "Format invalide. Utilisez YYYY-MM-DD"}).encode())
+                sections = parse_sections(params['sections'][0] if 'sections' in params else None)
+            except ValueError as e:
+                self.send_data(400, {"error": str(e), "sections": list(SECTIONS)})
                 return
             
-            # Connexion
-            client = Garmin(email, password)
-            client.login()
-            
-            # Fonctions helpers
-            def sec_to_time(seconds):
-                if not seconds or seconds == 0:
-                    return "0h00"
-                h = int(seconds // 3600)
-                m = int((seconds % 3600) // 60)
-                return f"{h}h{m:02d}"
-            
-            def safe_get(method_name, *args):
+            # MODE SYNC : /api/sync?start=...&end=... remplit l'historique des tendances
+            if parsed_url.path.rstrip('/').endswith('/sync'):
                 try:
-                    if hasattr(client, method_name):
-                        result = getattr(client, method_name)(*args)
-                        return result if result is not None else ({} if 'activit' not in method_name else [])
-                    return {} if 'activit' not in method_name else []
-                except:
-                    return {} if 'activit' not in method_name else []
-            
-            def get_val(data, key, default=0):
-                if data and isinstance(data, dict):
-                    val = data.get(key)
-                    return val if val is not None else default
-                return default
-            
-            # NOUVELLE FONCTION pour accéder aux données imbriquées
-            def get_nested_val(data, *keys, default=0):
-                """Accède aux valeurs imbriquées dans des dictionnaires"""
-                result = data
-                for key in keys:
-                    if isinstance(result, dict) and key in result:
-                        result = result[key]
-                    else:
-                        return default
-                return result if result is not None else default
-            
-            # Récupération données
-            stats = safe_get('get_stats', date_str)
-            sleep_data = safe_get('get_sleep_data', date_str)
-            activities = safe_get('get_activities_by_date', date_str, date_str)
-            stress_data = safe_get('get_stress_data', date_str)
-            body_battery = safe_get('get_body_battery', date_str, date_str)
-            respiration = safe_get('get_respiration_data', date_str)
-            spo2 = safe_get('get_spo2_data', date_str)
-            hrv = safe_get('get_hrv_data', date_str)
-            training_readiness = safe_get('get_training_readiness', date_str)
-            training_status = safe_get('get_training_status', date_str)
-            max_metrics = safe_get('get_max_metrics', date_str)
-            hydration = safe_get('get_hydration_data', date_str)
-            weight = safe_get('get_weigh_ins', date_str)
-            body_comp = safe_get('get_body_composition', date_str, date_str)
-            blood_pressure = safe_get('get_blood_pressure', date_str, date_str)
-            
-            # Extraction sommeil
-            daily_sleep = sleep_data.get('dailySleepDTO', {}) if isinstance(sleep_data, dict) else {}
-            sleep_levels = sleep_data.get('sleepLevels', []) if isinstance(sleep_data, dict) else []
-            sleep_movement = sleep_data.get('sleepMovement', []) if isinstance(sleep_data, dict) else []
-            
-            # ✅ CORRECTION HRV - Les données sont dans hrvSummary
-            hrv_summary = hrv.get('hrvSummary', {}) if isinstance(hrv, dict) else {}
-            hrv_baseline = hrv_summary.get('baseline', {}) if isinstance(hrv_summary, dict) else {}
-            
-            hrv_status = get_val(hrv_summary, 'status', None)
-            hrv_weekly_avg = get_val(hrv_summary, 'weeklyAvg', 0)
-            hrv_last_night = get_val(hrv_summary, 'lastNightAvg', 0)
-            hrv_last_night_5min = get_val(hrv_summary, 'lastNight5MinHigh', 0)
-            hrv_baseline_low = get_val(hrv_baseline, 'lowUpper', 0)
-            hrv_baseline_balanced_low = get_val(hrv_baseline, 'balancedLow', 0)
-            hrv_baseline_balanced_upper = get_val(hrv_baseline, 'balancedUpper', 0)
+                    end = datetime.strptime(params['end'][0], "%Y-%m-%d") if 'end' in params else datetime.now()
+                    start = datetime.strptime(params['start'][0], "%Y-%m-%d") if 'start' in params else end - timedelta(days=SYNC_DEFAULT_DAYS - 1)
+                except ValueError:
+                    self.send_data(400, {"error": "Format invalide. Utilisez YYYY-MM-DD"})
+                    return
+                start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+                end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+                if end < start or (end - start).days >= HISTORY_MAX_DAYS:
+                    self.send_data(400, {"error": f"Plage invalide (max {HISTORY_MAX_DAYS} jours, start <= end)"})
+                    return
+                client = get_client(email, password, self.timings)
+                self.send_stream(iter_sync(client, start, end))
+                return
             
-            # ✅ CORRECTION SPO2 - Les noms corrects
-            spo2_avg = get_val(spo2, 'averageSpO2', 0)
-            spo2_lowest = get_val(spo2, 'lowestSpO2', 0)
-            spo2_avg_sleep = get_val(spo2, 'avgSleepSpO2', 0)
+            # MODE SERIES : /api/series?metric=stress&date=...&points=200, série intraday réduite
+            if parsed_url.path.rstrip('/').endswith('/series'):
+                metric = params.get('metric', [''])[0]
+                if metric not in SERIES:
+                    self.send_data(400, {"error": "Série inconnue", "metrics": list(SERIES)})
+                    return
+                date_str = params['date'][0] if 'date' in params and params['date'][0] else datetime.now().strftime("%Y-%m-%d")
+                try:
+                    datetime.strptime(date_str, "%Y-%m-%d")
+                    points = int(params.get('points', [str(SERIES_DEFAULT_POINTS)])[0])
+                except ValueError:
+                    self.send_data(400, {"error": "Paramètres invalides (date YYYY-MM-DD, points entier)"})
+                    return
+                if not 3 <= points <= SERIES_MAX_POINTS:
+                    self.send_data(400, {"error": f"points doit être entre 3 et {SERIES_MAX_POINTS}"})
+                    return
+                client = get_client(email, password, self.timings)
+                method_name, args, _ = SERIES[metric]
+                payload, outcome, seconds, _ = timed_get(client, method_name, *args(date_str))
+                record_timing(self.timings, method_name, seconds, outcome, client.username)
+                series = build_series(metric, date_str, payload, points)
+                # Comme le mode normal : une série vide n'est pas confondue avec un échec
+                if outcome == 'timeout':
+                    series["timed_out"] = [method_name]
+                elif outcome not in FETCH_OK_OUTCOMES:
+                    series["failed"] = [method_name]
+                self.send_data(200, series)
+                return
             
-            # ✅ CORRECTION Training Readiness - C'est une LISTE !
-            if isinstance(training_readiness, list) and len(training_readiness) > 0:
-                tr_data = training_readiness[0]
-                readiness_score = get_val(tr_data, 'score', 0)
-                readiness_level = get_val(tr_data, 'level', None)
-                readiness_feedback_short = get_val(tr_data, 'feedbackShort', None)
-                readiness_feedback_long = get_val(tr_data, 'feedbackLong', None)
-                readiness_sleep_score = get_val(tr_data, 'sleepScore', 0)
-                readiness_recovery_time = get_val(tr_data, 'recoveryTime', 0)
-                readiness_hrv_weekly = get_val(tr_data, 'hrvWeeklyAverage', 0)
-            else:
-                readiness_score = 0
-                readiness_level = None
-                readiness_feedback_short = None
-                readiness_feedback_long = None
-                readiness_sleep_score = 0
-                readiness_recovery_time = 0
-                readiness_hrv_weekly = 0
+            # MODE ACTIVITES : /api/activities?start=...&end=...&cursor=...&limit=50, NDJSON paginé
+            if parsed_url.path.rstrip('/').endswith('/activities'):
+                try:
+                    end = datetime.strptime(params['end'][0], "%Y-%m-%d") if 'end' in params else datetime.now()
+                    start = datetime.strptime(params['start'][0], "%Y-%m-%d") if 'start' in params else end - timedelta(days=RANGE_CHUNK_DAYS - 1)
+                    limit = int(params.get('limit', [str(ACTIVITY_PAGE_SIZE)])[0])
+                except ValueError:
+                    self.send_data(400, {"error": "Paramètres invalides (start/end YYYY-MM-DD, limit entier)"})
+                    return
+                try:
+                    after = decode_cursor(params['cursor'][0]) if 'cursor' in params else None
+                except ValueError as e:
+                    self.send_data(400, {"error": str(e)})
+                    return
+                start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+                end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+                if end < start or (end - start).days >= MAX_RANGE_DAYS or not 1 <= limit <= ACTIVITY_MAX_PAGE_SIZE:
+                    self.send_data(400, {"error": f"Paramètres invalides (max {MAX_RANGE_DAYS} jours, start <= end, limit entre 1 et {ACTIVITY_MAX_PAGE_SIZE})"})
+                    return
+                client = get_client(email, password, self.timings)
+                self.send_stream(iter_activities(client, start, end, after, limit))
+                return
             
-            # Durées sommeil
-            sleep_total_sec = get_val(daily_sleep, "sleepTimeSeconds", 0)
-            sleep_deep_sec = get_val(daily_sleep, "deepSleepSeconds", 0)
-            sleep_light_sec = get_val(daily_sleep, "lightSleepSeconds", 0)
-            sleep_rem_sec = get_val(daily_sleep, "remSleepSeconds", 0)
-            sleep_awake_sec = get_val(daily_sleep, "awakeSleepSeconds", 0)
-            sleep_unmeas_sec = get_val(daily_sleep, "unmeasurableSleepSeconds", 0)
-            sleep_nap_sec = get_val(daily_sleep, "napTimeSeconds", 0)
+            # MODE PLAGE : ?start=YYYY-MM-DD&end=YYYY-MM-DD, un résumé NDJSON par jour
+            if 'start' in params:
+                try:
+                    start = datetime.strptime(params['start'][0], "%Y-%m-%d")
+                    end = datetime.strptime(params['end'][0], "%Y-%m-%d") if 'end' in params and params['end'][0] else datetime.now()
+                except ValueError:
+                    self.send_data(400, {"error": "Format invalide. Utilisez YYYY-MM-DD"})
+                    return
+                start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+                end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+                if end < start or (end - start).days >= MAX_RANGE_DAYS:
+                    self.send_data(400, {"error": f"Plage invalide (max {MAX_RANGE_DAYS} jours, start <= end)"})
+                    return
+                
+                client = get_client(email, password, self.timings)
+                
+                self.send_stream(iter_range_summaries(client, start, end, sections))
+                return
             
-            # FC moyenne : chercher dans les activités si pas dans stats
-            avg_hr = get_val(stats, 'averageHeartRateInBeatsPerMinute', 0)
-            if avg_hr == 0:
-                avg_hr = get_val(stats, 'avgHeartRate', 0)
-            if avg_hr == 0 and isinstance(activities, list) and len(activities) > 0:
-                hr_values = [act.get('averageHR', 0) for act in activities if act.get('averageHR', 0) > 0]
-                avg_hr = round(sum(hr_values) / len(hr_values)) if hr_values else 0
+            date_str = params['date'][0] if 'date' in params and params['date'][0] else datetime.now().strftime("%Y-%m-%d")
             
-            # Hydration
-            hydration_total = get_val(hydration, 'valueInML', None)
-            hydration_goal = get_val(hydration, 'goalInML', 0)
-            hydration_sweat = get_val(hydration, 'sweatLossInML', None)
+            try:
+                datetime.strptime(date_str, "%Y-%m-%d")
+            except ValueError:
+                self.send_data(400, {"error": "Format invalide. Utilisez YYYY-MM-DD"})
+                return
             
-            # Sleep scores
-            sleep_scores = daily_sleep.get('sleepScores', {}) if isinstance(daily_sleep, dict) else {}
+            # Connexion (réutilise les tokens sauvegardés si possible)
+            client = get_client(email, password, self.timings)
             
-            # Réponse complète
-            data = {
-                "date": date_str,
-                "timestamp": datetime.now().isoformat(),
-                "basic_stats": {
-                    "steps": get_val(stats, "totalSteps", 0),
-                    "distance_km": round(get_val(stats, "totalDistanceMeters", 0) / 1000, 2),
-                    "calories_active": get_val(stats, "activeKilocalories", 0),
-                    "calories_total": get_val(stats, "totalKilocalories", 0),
-                    "calories_bmr": get_val(stats, "bmrKilocalories", 0),
-                    "floors_ascended": get_val(stats, "floorsAscended", 0),
-                    "floors_descended": get_val(stats, "floorsDescended", 0),
-                    "intensity_minutes_moderate": get_val(stats, "moderateIntensityMinutes", 0),
-                    "intensity_minutes_vigorous": get_val(stats, "vigorousIntensityMinutes", 0),
-                    "intensity_minutes_goal": get_val(stats, "intensityMinutesGoal", 0),
-                    "steps_goal": get_val(stats, "dailyStepGoal", 0),
-                },
-                "heart_rate": {
-                    "avg": avg_hr,
-                    "resting": get_val(stats, "restingHeartRate", 0),
-                    "max": get_val(stats, "maxHeartRate", 0),
-                    "min": get_val(stats, "minHeartRate", 0),
-                    "hrv_weekly_avg": hrv_weekly_avg,
-                    "hrv_last_night": hrv_last_night,
-                    "hrv_last_night_5min_high": hrv_last_night_5min,
-                    "hrv_status": hrv_status,
-                    "hrv_baseline_low_upper": hrv_baseline_low,
-                    "hrv_baseline_balanced_low": hrv_baseline_balanced_low,
-                    "hrv_baseline_balanced_upper": hrv_baseline_balanced_upper,
-                },
-                "sleep": {
-                    "total_hours": round(sleep_total_sec / 3600, 2),
-                    "total_formatted": sec_to_time(sleep_total_sec),
-                    "deep_hours": round(sleep_deep_sec / 3600, 2),
-                    "deep_formatted": sec_to_time(sleep_deep_sec),
-                    "light_hours": round(sleep_light_sec / 3600, 2),
-                    "light_formatted": sec_to_time(sleep_light_sec),
-                    "rem_hours": round(sleep_rem_sec / 3600, 2),
-                    "rem_formatted": sec_to_time(sleep_rem_sec),
-                    "awake_hours": round(sleep_awake_sec / 3600, 2),
-                    "awake_formatted": sec_to_time(sleep_awake_sec),
-                    "unmeasurable_hours": round(sleep_unmeas_sec / 3600, 2),
-                    "unmeasurable_formatted": sec_to_time(sleep_unmeas_sec),
-                    "nap_time_hours": round(sleep_nap_sec / 3600, 2),
-                    "nap_formatted": sec_to_time(sleep_nap_sec),
-                    "sleep_score_overall": get_val(sleep_scores, 'overall', 0),
-                    "sleep_score_quality": get_val(sleep_scores, 'qualityScore', 0),
-                    "sleep_score_recovery": get_val(sleep_scores, 'recoveryScore', 0),
-                    "sleep_score_duration": get_val(sleep_scores, 'durationScore', 0),
-                    "sleep_score_feedback": get_val(daily_sleep, "sleepScoreFeedback", None),
-                    "sleep_score_insight": get_val(daily_sleep, "sleepScoreInsight", None),
-                    "awake_count": get_val(daily_sleep, "awakeCount", 0),
-                    "avg_sleep_stress": get_val(daily_sleep, "avgSleepStress", 0),
-                    "sleep_start": get_val(daily_sleep, "sleepStartTimestampLocal", None),
-                    "sleep_end": get_val(daily_sleep, "sleepEndTimestampLocal", None),
-                    "sleep_window_confirmed": get_val(daily_sleep, "sleepWindowConfirmed", False),
-                    "avg_respiration": get_val(daily_sleep, 'averageRespirationValue', 0),
-                    "lowest_respiration": get_val(daily_sleep, 'lowestRespirationValue', 0),
-                    "highest_respiration": get_val(daily_sleep, 'highestRespirationValue', 0),
-                    "avg_spo2_sleep": get_val(daily_sleep, 'averageSpO2Value', 0),
-                    "sleep_levels_count": len(sleep_levels),
-                    "sleep_movements_count": len(sleep_movement),
-                },
-                "body_battery": {
-                    "charged": get_val(stats, "bodyBatteryChargedValue", 0),
-                    "drained": get_val(stats, "bodyBatteryDrainedValue", 0),
-                    "highest": get_val(stats, "bodyBatteryHighestValue", 0),
-                    "lowest": get_val(stats, "bodyBatteryLowestValue", 0),
-                    "current": body_battery[-1].get("charged", 0) if isinstance(body_battery, list) and len(body_battery) > 0 else 0,
-                },
-                "stress": {
-                    "avg": get_val(stats, "averageStressLevel", 0),
-                    "max": get_val(stats, "maxStressLevel", 0),
-                    "rest_stress_duration": get_val(stats, "restStressDuration", 0),
-                    "activity_stress_duration": get_val(stats, "activityStressDuration", 0),
-                    "low_stress_duration": get_val(stats, "lowStressDuration", 0),
-                    "medium_stress_duration": get_val(stats, "mediumStressDuration", 0),
-                    "high_stress_duration": get_val(stats, "highStressDuration", 0),
-                },
-                "respiration": {
-                    "avg_waking": get_val(stats, 'avgWakingRespirationValue', 0),
-                    "highest": get_val(stats, 'highestRespirationValue', 0),
-                    "lowest": get_val(stats, 'lowestRespirationValue', 0),
-                },
-                "spo2": {
-                    "avg": spo2_avg,
-                    "lowest": spo2_lowest,
-                    "avg_sleep": spo2_avg_sleep,
-                    "last_7_days_avg": get_val(spo2, 'lastSevenDaysAvgSpO2', 0),
-                },
-                "training": {
-                    "readiness_score": readiness_score,
-                    "readiness_level": readiness_level,
-                    "readiness_feedback_short": readiness_feedback_short,
-                    "readiness_feedback_long": readiness_feedback_long,
-                    "readiness_sleep_score": readiness_sleep_score,
-                    "readiness_recovery_time_hours": round(readiness_recovery_time / 3600, 2) if readiness_recovery_time else 0,
-                    "readiness_hrv_weekly_avg": readiness_hrv_weekly,
-                    "training_status": get_val(training_status, 'trainingStatus', None),
-                    "vo2_max": get_val(max_metrics, 'vo2MaxValue', 0),
-                    "fitness_age": get_val(max_metrics, 'fitnessAge', 0),
-                },
-                "activities": {
-                    "count": len(activities) if isinstance(activities, list) else 0,
-                    "list": [
-                        {
-                            "name": act.get("activityName", ""),
-                            "type": act.get("activityType", {}).get("typeKey", "") if isinstance(act.get("activityType"), dict) else "",
-                            "duration_minutes": round(act.get("duration", 0) / 60, 2),
-                            "duration_formatted": sec_to_time(act.get("duration", 0)),
-                            "distance_km": round(act.get("distance", 0) / 1000, 2),
-                            "calories": act.get("calories", 0),
-                            "avg_hr": act.get("averageHR", 0),
-                            "max_hr": act.get("maxHR", 0),
-                            "avg_speed": round(act.get("averageSpeed", 0) * 3.6, 2),
-                            "elevation_gain": act.get("elevationGain", 0),
-                            "elevation_loss": act.get("elevationLoss", 0),
-                            "avg_cadence": act.get("averageRunningCadenceInStepsPerMinute", 0),
-                            "max_cadence": act.get("maxRunningCadenceInStepsPerMinute", 0),
-                        }
-                        for act in (activities[:20] if isinstance(activities, list) else [])
-                    ]
-                },
-                "body_composition": {
-                    "weight_kg": round(get_val(weight, "weight", 0) / 1000, 2) if get_val(weight, "weight", 0) > 0 else 0,
-                    "bmi": get_val(body_comp, "bmi", 0),
-                    "body_fat_percentage": get_val(body_comp, "bodyFat", 0),
-                    "body_water_percentage": get_val(body_comp, "bodyWater", 0),
-                    "bone_mass_kg": get_val(body_comp, "boneMass", 0),
-                    "muscle_mass_kg": get_val(body_comp, "muscleMass", 0),
-                    "metabolic_age": get_val(body_comp, "metabolicAge", 0),
-                    "visceral_fat": get_val(body_comp, "visceralFat", 0),
-                },
-                "hydration": {
-                    "total_ml": hydration_total,
-                    "goal_ml": hydration_goal,
-                    "sweat_loss_ml": hydration_sweat,
-                },
-                "blood_pressure": {
-                    "systolic": (
-                        blood_pressure[0].get("systolic", 0) if isinstance(blood_pressure, list) and len(blood_pressure) > 0 
-                        else get_val(blood_pressure, "systolic", 0) if isinstance(blood_pressure, dict) 
-                        else 0
-                    ),
-                    "diastolic": (
-                        blood_pressure[0].get("diastolic", 0) if isinstance(blood_pressure, list) and len(blood_pressure) > 0 
-                        else get_val(blood_pressure, "diastolic", 0) if isinstance(blood_pressure, dict) 
-                        else 0
-                    ),
-                    "pulse": (
-                        blood_pressure[0].get("pulse", 0) if isinstance(blood_pressure, list) and len(blood_pressure) > 0 
-                        else get_val(blood_pressure, "pulse", 0) if isinstance(blood_pressure, dict) 
-                        else 0
-                    ),
-                },
-            }
+            # Récupération données (appels Garmin en parallèle, avec délai global)
+            raw, timed_out, failed = fetch_all(client, calls_for_sections(date_str, sections), timings=self.timings)
+            started = time.perf_counter()
+            data = build_summary(date_str, raw, sections)
+            self.timings.append(('build', time.perf_counter() - started, 'ok'))
+            if timed_out:
+                data["timed_out"] = timed_out
+            if failed:
+                data["failed"] = failed
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(data, indent=2).encode())
+            # ETag : 304 si le client a déjà ce résumé
+            self.send_data(200, data, etag=summary_etag(data))
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error_response = {
                 "error": str(e),
                 "type": type(e).__name__,
                 "traceback": traceback.format_exc()
             }
-            self.wfile.write(json.dumps(error_response).encode())
+            self.send_data(500, error_response)
+
+
+# Self-hosting : python api/index.py serve --port 8000 --workers 16 --keepalive 15
+SERVER_WORKERS = int(os.environ.get('GARMIN_SERVER_WORKERS', '16'))
+SERVER_KEEPALIVE = float(os.environ.get('GARMIN_SERVER_KEEPALIVE', '15'))
+
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """HTTPServer à un thread par connexion, qui traite au plus `workers` requêtes à la fois
+
+    Une connexion keep-alive inactive attend sa requête suivante hors de cette limite :
+    elle ne bloque pas les autres clients.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, handler_class, workers):
+        class PooledHandler(handler_class):
+            def handle_one_request(self):
+                try:
+                    ready = self.rfile.peek(1)
+                except OSError:
+                    ready = b''
+                if not ready:
+                    self.close_connection = True
+                    return
+                with self.server.slots:
+                    super().handle_one_request()
+
+        super().__init__(address, PooledHandler)
+        self.slots = threading.Semaphore(workers)
+
+
+def serve(host='0.0.0.0', port=8000, workers=SERVER_WORKERS, keepalive=SERVER_KEEPALIVE):
+    """Sert `handler` en HTTP/1.1 keep-alive ; une connexion inactive est fermée après `keepalive` s"""
+
+    class KeepAliveHandler(handler):
+        protocol_version = 'HTTP/1.1'
+        timeout = keepalive
+
+    server = PooledHTTPServer((host, port), KeepAliveHandler, workers)
+    print(f"garmin-api sur http://{host}:{port} ({workers} workers, keep-alive {keepalive}s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def startup_report(top=15):
+    """Temps d'import (python -X importtime) et de cold start, étape par étape"""
+    import subprocess
+    here = os.path.abspath(__file__)
+    steps = [
+        ("import api/index.py", f"import runpy; runpy.run_path({here!r})"),
+        ("import garminconnect", "import garminconnect"),
+        ("import numpy", "import numpy"),
+    ]
+    for label, code in steps:
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+        wall = time.perf_counter() - started
+        modules = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line or 'self [us]' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            # Un seul espace d'indentation : module importé directement (pas une dépendance)
+            if len(name) - len(name.lstrip()) == 1:
+                modules.append((int(cumulative), name.strip()))
+        total = sum(c for c, _ in modules)
+        status = "ok" if proc.returncode == 0 else "échec : " + (proc.stderr.strip().splitlines() or ["?"])[-1]
+        print(f"\n{label} : {wall * 1000:.0f} ms (process compris), {total / 1000:.0f} ms d'imports, {status}")
+        for cumulative, name in sorted(modules, reverse=True)[:top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    # Premier login de l'instance (tokens de TOKEN_DIR ou mot de passe)
+    email = os.environ.get('GARMIN_EMAIL')
+    password = os.environ.get('GARMIN_PASSWORD')
+    if not email or not password:
+        print("\nlogin : GARMIN_EMAIL/GARMIN_PASSWORD absents, étape ignorée")
+        return
+    started = time.perf_counter()
+    try:
+        get_client(email, password)
+    except Exception as e:
+        print(f"\nlogin : échec ({type(e).__name__}: {e})")
+        return
+    print(f"\nlogin : {(time.perf_counter() - started) * 1000:.0f} ms, sessions {METRICS.sessions()}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="garmin-api hors Vercel")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="serveur HTTP multi-thread")
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    serve_parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    serve_parser.add_argument('--keepalive', type=float, default=SERVER_KEEPALIVE)
+    report_parser = commands.add_parser('startup-report', help="temps d'import et de cold start")
+    report_parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.host, args.port, args.workers, args.keepalive)
+    else:
+        startup_report(args.top)
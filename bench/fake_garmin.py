@@ -0,0 +1,174 @@
+"""Stand-in local de garminconnect.Garmin pour les benchmarks.
+
+Sert les fixtures JSON de bench/fixtures (une par méthode, enregistrées pour le
+jour FIXTURE_DATE) en remplaçant la date, avec une latence, un taux d'erreur et
+une taille de payload configurables. install() l'enregistre comme module
+`garminconnect` pour que api/index.py l'importe à la place du vrai client.
+"""
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_DATE = "2024-01-15"
+
+# Méthodes dont Garmin renvoie une plage : la fixture d'un jour est répétée pour chaque date
+RANGED_METHODS = ('get_activities_by_date', 'get_body_battery', 'get_body_composition', 'get_blood_pressure')
+
+
+class FakeConfig:
+    """Paramètres partagés par tous les FakeGarmin"""
+
+    def __init__(self, latency=0.05, jitter=0.02, login_latency=0.3, error_rate=0.0, payload_scale=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.login_latency = login_latency
+        self.error_rate = error_rate
+        self.payload_scale = payload_scale
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.logins = 0
+
+    def count(self, method_name):
+        with self.lock:
+            self.calls[method_name] = self.calls.get(method_name, 0) + 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls = {}
+            self.logins = 0
+
+    def sleep(self, base):
+        with self.lock:
+            delay = base + self.random.uniform(-self.jitter, self.jitter) if base else 0
+            failed = self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+
+CONFIG = FakeConfig()
+
+
+class FakeUpstreamError(Exception):
+    """Erreur simulée d'un appel Garmin"""
+
+
+class FakeToken:
+    expired = False
+
+
+class FakeGarth:
+    """Sous-ensemble de garth.Client utilisé par api/index.py"""
+
+    def __init__(self):
+        self.oauth1_token = None
+        self.oauth2_token = None
+        self.timeout = 10
+
+    def dump(self, dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, 'oauth2_token.json'), 'w') as f:
+            json.dump({"fake": True}, f)
+
+    def load(self, dir_path):
+        with open(os.path.join(dir_path, 'oauth2_token.json')) as f:
+            json.load(f)
+        self.oauth1_token = self.oauth2_token = FakeToken()
+
+    def dumps(self):
+        return "fake-token-" + "x" * 600
+
+    def refresh_oauth2(self):
+        self.oauth2_token = FakeToken()
+
+
+_fixtures = {}
+
+
+def load_fixture(method_name):
+    if method_name not in _fixtures:
+        with open(os.path.join(FIXTURE_DIR, method_name + '.json')) as f:
+            _fixtures[method_name] = f.read()
+    return _fixtures[method_name]
+
+
+def _scale(payload, factor):
+    """Multiplie la longueur des séries (listes de plus de 20 éléments)"""
+    if factor == 1:
+        return payload
+    if isinstance(payload, dict):
+        return {k: _scale(v, factor) for k, v in payload.items()}
+    if isinstance(payload, list):
+        items = [_scale(v, factor) for v in payload]
+        return items * factor if len(items) > 20 else items
+    return payload
+
+
+def _merge(payloads):
+    """Fusionne les fixtures de plusieurs jours comme le ferait une réponse sur une plage"""
+    if isinstance(payloads[0], list):
+        return [item for payload in payloads for item in payload]
+    merged = dict(payloads[0])
+    for payload in payloads[1:]:
+        for key, value in payload.items():
+            if isinstance(value, list):
+                merged[key] = merged[key] + value
+    return merged
+
+
+def fixture_for(method_name, start, end=None):
+    days = [start]
+    if end and end != start and method_name in RANGED_METHODS:
+        day = datetime.strptime(start, "%Y-%m-%d")
+        last = datetime.strptime(end, "%Y-%m-%d")
+        days = []
+        while day <= last:
+            days.append(day.strftime("%Y-%m-%d"))
+            day += timedelta(days=1)
+    text = load_fixture(method_name)
+    # Les méthodes par activité reçoivent un activityId, pas une date
+    payloads = [json.loads(text.replace(FIXTURE_DATE, day) if isinstance(day, str) else text) for day in days]
+    return _scale(_merge(payloads) if len(payloads) > 1 else payloads[0], CONFIG.payload_scale)
+
+
+class FakeGarmin:
+    """Remplace garminconnect.Garmin : mêmes méthodes, données des fixtures"""
+
+    def __init__(self, email=None, password=None, *args, **kwargs):
+        self.username = email
+        self.password = password
+        self.garth = FakeGarth()
+
+    def login(self, tokenstore=None):
+        if tokenstore is None:
+            with CONFIG.lock:
+                CONFIG.logins += 1
+            CONFIG.sleep(CONFIG.login_latency)
+        self.garth.oauth1_token = self.garth.oauth2_token = FakeToken()
+        return None, None
+
+    def _serve(self, method_name, *args):
+        CONFIG.count(method_name)
+        if CONFIG.sleep(CONFIG.latency):
+            raise FakeUpstreamError(f"{method_name} failed")
+        return fixture_for(method_name, *args[:2])
+
+    def __getattr__(self, name):
+        if name.startswith('get_') and os.path.exists(os.path.join(FIXTURE_DIR, name + '.json')):
+            return lambda *args: self._serve(name, *args)
+        raise AttributeError(name)
+
+
+def install():
+    """Enregistre ce module comme `garminconnect` avant l'import de api/index.py"""
+    module = types.ModuleType('garminconnect')
+    module.Garmin = FakeGarmin
+    sys.modules['garminconnect'] = module
+    return module
@@ -0,0 +1,292 @@
+"""Benchmarks hors ligne de api/index.py avec un client Garmin simulé (bench/fake_garmin.py).
+
+    python bench/run.py                               # tous les scénarios, en process
+    python bench/run.py --transport http              # via le serveur de self-hosting (keep-alive)
+    python bench/run.py --latency 0.1 --error-rate 0.05 --payload-scale 4
+    python bench/run.py --output bench/results/$(git rev-parse --short HEAD).json
+    python bench/run.py --compare bench/results/abc1234.json
+    python bench/run.py --fixtures /tmp/garmin_fixtures/2024-03-02 --fixture-date 2024-03-02
+
+Chaque scénario combine un état (cold : ni session, ni tokens, ni cache ;
+warm : instance déjà servie), une requête (un jour ou une plage de 7 jours) et
+une projection (toutes les sections ou seulement `sleep`), ou l'export d'un mois
+d'activités.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import http.client
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import fake_garmin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dates anciennes : le cache les garde indéfiniment en scénario warm
+SCENARIOS = {
+    "single_full": "/api/?date=2024-02-01",
+    "single_sleep": "/api/?date=2024-02-01&sections=sleep",
+    "range_full": "/api/?start=2024-02-01&end=2024-02-07",
+    "range_sleep": "/api/?start=2024-02-01&end=2024-02-07&sections=sleep",
+    "activities": "/api/activities?start=2024-02-01&end=2024-02-29",
+}
+STATES = ("cold", "warm")
+
+
+def load_index(workdir):
+    """Importe api/index.py avec le faux garminconnect et un état isolé dans workdir"""
+    fake_garmin.install()
+    os.environ.setdefault('GARMIN_EMAIL', 'bench@example.com')
+    os.environ.setdefault('GARMIN_PASSWORD', 'bench')
+    os.environ['GARMIN_TOKEN_DIR'] = os.path.join(workdir, 'tokens')
+    os.environ['GARMIN_CACHE_DB'] = os.path.join(workdir, 'cache.sqlite')
+    # Le fake ne limite pas le débit : le token bucket ne doit pas dominer les mesures
+    os.environ.setdefault('GARMIN_UPSTREAM_RATE', '1000')
+    os.environ.setdefault('GARMIN_UPSTREAM_BURST', '1000')
+    spec = importlib.util.spec_from_file_location('garmin_api_index', os.path.join(ROOT, 'api', 'index.py'))
+    index = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(index)
+
+    class QuietHandler(index.handler):
+        def log_message(self, format, *args):
+            pass
+
+    index.QuietHandler = QuietHandler
+    return index
+
+
+def reset_state(index):
+    """Remet l'instance dans l'état d'un cold start sans tokens ni cache"""
+    index.client_pool.clear()
+    index.schedulers.clear()
+    shutil.rmtree(index.TOKEN_DIR, ignore_errors=True)
+    if os.path.exists(index.CACHE_DB):
+        os.remove(index.CACHE_DB)
+    index.upstream_cache = index.UpstreamCache(index.CACHE_DB, index.CACHE_SIZE)
+
+
+class _Connection:
+    """Socket en mémoire : le handler lit la requête et écrit la réponse ici"""
+
+    def __init__(self, raw_request):
+        self.rfile = io.BytesIO(raw_request)
+        self.out = bytearray()
+
+    def makefile(self, mode, *args, **kwargs):
+        return self.rfile
+
+    def sendall(self, data):
+        self.out += data
+
+
+class InProcessTransport:
+    """Appelle le handler directement, parsing HTTP compris, sans socket"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def get(self, path, headers=None):
+        lines = [f"GET {path} HTTP/1.1", "Host: bench"] + [f"{k}: {v}" for k, v in (headers or {}).items()]
+        conn = _Connection(("\r\n".join(lines) + "\r\n\r\n").encode())
+        self.index.QuietHandler(conn, ('127.0.0.1', 0), None)
+        head, _, body = bytes(conn.out).partition(b"\r\n\r\n")
+        return int(head.split(b" ", 2)[1]), body
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """Serveur de self-hosting local (PooledHTTPServer, HTTP/1.1 keep-alive) et
+    requêtes via http.client, une connexion réutilisée par thread client"""
+
+    def __init__(self, index):
+        class KeepAliveHandler(index.QuietHandler):
+            protocol_version = 'HTTP/1.1'
+            timeout = index.SERVER_KEEPALIVE
+
+        self.server = index.PooledHTTPServer(('127.0.0.1', 0), KeepAliveHandler, index.SERVER_WORKERS)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.local = threading.local()
+        self.connections = []
+
+    def get(self, path, headers=None):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(*self.server.server_address)
+            self.connections.append(conn)
+        try:
+            conn.request('GET', path, headers=headers or {})
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        except (http.client.HTTPException, OSError):
+            # Connexion fermée par le serveur (flux NDJSON, keep-alive expiré) : une nouvelle
+            conn.close()
+            conn.request('GET', path, headers=headers or {})
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def run_scenario(index, transport, path, state, iterations, concurrency):
+    """Latences, débit et appels Garmin d'un scénario"""
+    reset_state(index)
+    if state == "warm":
+        transport.get(path)
+    fake_garmin.CONFIG.reset_counts()
+
+    def one(_):
+        if state == "cold":
+            reset_state(index)
+        started = time.perf_counter()
+        status, body = transport.get(path)
+        elapsed = time.perf_counter() - started
+        if status != 200:
+            raise RuntimeError(f"{path} -> {status}: {body[:200]!r}")
+        return elapsed, len(body)
+
+    started = time.perf_counter()
+    if state == "cold" or concurrency == 1:
+        # Un cold start ne se partage pas entre requêtes concurrentes
+        results = [one(i) for i in range(iterations)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(iterations)))
+    wall = time.perf_counter() - started
+    latencies = [r[0] for r in results]
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "throughput_rps": round(iterations / wall, 2),
+        "response_bytes": results[-1][1],
+        "upstream_calls_per_request": round(sum(fake_garmin.CONFIG.calls.values()) / iterations, 2),
+        "logins": fake_garmin.CONFIG.logins,
+    }
+
+
+def measure_memory(index, transport, path, state):
+    """Pic mémoire et blocs alloués (nets) d'une requête, mesurés avec tracemalloc"""
+    reset_state(index)
+    if state == "warm":
+        transport.get(path)
+    tracemalloc.start()
+    try:
+        blocks = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        transport.get(path)
+        _, peak = tracemalloc.get_traced_memory()
+        net_blocks = sys.getallocatedblocks() - blocks
+    finally:
+        tracemalloc.stop()
+    return {"peak_memory_kb": round(peak / 1024, 1), "net_alloc_blocks": net_blocks}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current):
+    """Tableau des écarts entre deux fichiers de résultats"""
+    print(f"{'scenario':<22}{'p50 ms':>18}{'p95 ms':>18}{'rps':>18}")
+    for name, result in current["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "throughput_rps"):
+            delta = (result[key] - old[key]) / old[key] * 100 if old[key] else 0
+            cells.append(f"{result[key]:>9.1f} ({delta:+5.1f}%)")
+        print(f"{name:<22}" + "".join(f"{c:>18}" for c in cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.05, help="latence par appel Garmin (s)")
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--login-latency', type=float, default=0.3)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--payload-scale', type=int, default=1, help="facteur de taille des séries")
+    parser.add_argument('--fixtures', help="dossier de fixtures enregistrées par ?debug&record=1")
+    parser.add_argument('--fixture-date', help="jour des fixtures de --fixtures (YYYY-MM-DD)")
+    parser.add_argument('--scenario', action='append', choices=[f"{s}_{n}" for s in STATES for n in SCENARIOS])
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    parser.add_argument('--compare', help="fichier JSON de résultats de référence")
+    args = parser.parse_args(argv)
+
+    if args.fixtures:
+        fake_garmin.FIXTURE_DIR = args.fixtures
+        fake_garmin.FIXTURE_DATE = args.fixture_date or os.path.basename(os.path.normpath(args.fixtures))
+    fake_garmin.CONFIG.__init__(args.latency, args.jitter, args.login_latency, args.error_rate, args.payload_scale, seed=1)
+    workdir = tempfile.mkdtemp(prefix='garmin-bench-')
+    index = load_index(workdir)
+    transport = HttpTransport(index) if args.transport == 'http' else InProcessTransport(index)
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'scenario')},
+        "scenarios": {},
+    }
+    try:
+        for state in STATES:
+            for name, path in SCENARIOS.items():
+                key = f"{state}_{name}"
+                if args.scenario and key not in args.scenario:
+                    continue
+                result = run_scenario(index, transport, path, state, args.iterations, args.concurrency)
+                result.update(measure_memory(index, transport, path, state))
+                results["scenarios"][key] = result
+                print(f"{key:<22} p50={result['p50_ms']:>8.1f}ms p95={result['p95_ms']:>8.1f}ms "
+                      f"p99={result['p99_ms']:>8.1f}ms {result['throughput_rps']:>7.1f} req/s "
+                      f"peak={result['peak_memory_kb']:>8.1f}KB calls={result['upstream_calls_per_request']}")
+    finally:
+        transport.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return results
+
+
+if __name__ == '__main__':
+    main()